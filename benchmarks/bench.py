@@ -0,0 +1,218 @@
+import argparse
+import datetime
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+from dotenv import dotenv_values
+from benchmarks.synthetic_web import SyntheticWeb
+from database.db import DatabaseController
+from storage.page_store import PageStore
+from services.spider.crawler import ResumableCrawler, create_crawler_tables
+from services.indexer.indexer import ResumableIndexer, create_index_tables
+from services.indexer.pipeline import IndexingPipeline
+from services.indexer.dedup import SimHashIndex
+from services.indexer.segment import SegmentReader, export_segment
+from services.indexer.query import QueryEngine, SearchServer
+
+# Metrics where a larger value is an improvement; everything else is better smaller
+HIGHER_IS_BETTER = {"crawl_urls_per_sec", "index_pages_per_sec"}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children (parse workers), in MB"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return round(own, 1), round(children, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def bench_crawl(db, web, page_store, workers):
+    create_crawler_tables(db)
+    crawler = ResumableCrawler(
+        seed_urls=[web.url(0)],
+        max_workers=workers,
+        db=db,
+        page_store=page_store,
+        host_delay=0.0,  # Politeness is for real hosts; measure raw throughput
+        per_host_limit=workers
+    )
+    start = time.perf_counter()
+    crawler.crawl()
+    elapsed = time.perf_counter() - start
+    return {
+        "urls_crawled": crawler.urls_crawled,
+        "crawl_seconds": round(elapsed, 3),
+        "crawl_urls_per_sec": round(crawler.urls_crawled / elapsed, 2)
+    }
+
+
+def bench_index(db, page_store):
+    create_index_tables(db)
+    indexer = ResumableIndexer(db, "crawler_queue", page_store=page_store, dedup=SimHashIndex())
+    pipeline = IndexingPipeline(indexer)
+    start = time.perf_counter()
+    pipeline.run()
+    elapsed = time.perf_counter() - start
+
+    rows = db.execute("SELECT status, COUNT(*) FROM indexing_status GROUP BY status", fetch=True)
+    statuses = {status: count for status, count in rows}
+    return {
+        "pages_indexed": statuses.get("indexed", 0),
+        "pages_duplicate": statuses.get("duplicate", 0),
+        "pages_failed": statuses.get("failed", 0),
+        "index_seconds": round(elapsed, 3),
+        "index_pages_per_sec": round(sum(statuses.values()) / elapsed, 2)
+    }
+
+
+def bench_queries(db, web, segment_path, queries):
+    export_segment(db, segment_path)
+    segment = SegmentReader(segment_path)
+    server = SearchServer(("127.0.0.1", 0), QueryEngine(segment), db)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = f"http://127.0.0.1:{server.server_port}/search"
+    session = requests.Session()
+    latencies = []
+    try:
+        for query in web.query_terms(queries):
+            start = time.perf_counter()
+            response = session.get(url, params={"q": query, "limit": 10})
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+        segment.close()
+
+    return {
+        "queries": len(latencies),
+        "query_p50_ms": round(percentile(latencies, 0.50), 3),
+        "query_p99_ms": round(percentile(latencies, 0.99), 3)
+    }
+
+
+def run_benchmarks(host, user, password, database, pages=2000, out_degree=8, hosts=10, page_size=8 * 1024,
+                   latency=0.0, error_rate=0.0, queries=500, workers=20, seed=1, keep=False):
+    """
+    Crawl, index and query a synthetic local web against a throwaway
+    database (`<database>_bench`, dropped afterwards unless keep=True).
+    Returns the results as a dict.
+    """
+    config = {
+        "pages": pages, "out_degree": out_degree, "hosts": hosts, "page_size": page_size,
+        "latency": latency, "error_rate": error_rate, "queries": queries, "workers": workers, "seed": seed
+    }
+    web = SyntheticWeb(pages=pages, out_degree=out_degree, hosts=hosts, page_size=page_size, latency=latency,
+                       error_rate=error_rate, seed=seed)
+    workdir = tempfile.mkdtemp(prefix="search-engine-bench-")
+    bench_database = f"{database}_bench"
+    results = {}
+
+    web.start()
+    db = DatabaseController(host=host, user=user, password=password, database=bench_database, pool_size=16)
+    page_store = PageStore(os.path.join(workdir, "page_store"))
+    try:
+        print("[BENCH]: Crawling...")
+        results.update(bench_crawl(db, web, page_store, workers))
+        print("[BENCH]: Indexing...")
+        results.update(bench_index(db, page_store))
+        print("[BENCH]: Querying...")
+        results.update(bench_queries(db, web, os.path.join(workdir, "index.seg"), queries))
+        results["peak_rss_mb"], results["peak_rss_children_mb"] = peak_rss_mb()
+    finally:
+        page_store.close()
+        web.stop()
+        if not keep:
+            db.execute(f"DROP DATABASE IF EXISTS {bench_database}")
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"[BENCH]: Kept database '{bench_database}' and files in {workdir}")
+        db.close()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "config": config,
+        "results": results
+    }
+
+
+def compare(baseline, current):
+    """Print each metric next to a baseline run, with the change in percent"""
+    print(f"{'metric':<24}{'baseline':>14}{'current':>14}{'change':>10}")
+    for metric, value in current["results"].items():
+        old = baseline.get("results", {}).get(metric)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+            print(f"{metric:<24}{str(old):>14}{value:>14}")
+            continue
+        change = (value - old) / old * 100
+        better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+        marker = "" if abs(change) < 5 else (" +" if better else " -")
+        print(f"{metric:<24}{old:>14}{value:>14}{change:>9.1f}%{marker}")
+    if baseline.get("config") != current["config"]:
+        print("[BENCH]: Warning: the baseline was run with a different configuration")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the crawler, indexer and search server offline.")
+    parser.add_argument('--pages', type=int, default=2000, help='Pages in the synthetic web')
+    parser.add_argument('--out-degree', type=int, default=8, help='Links per page')
+    parser.add_argument('--hosts', type=int, default=10, help='Hosts the pages are spread over')
+    parser.add_argument('--page-size', type=int, default=8 * 1024, help='Approximate page size in bytes')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean response delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of pages that answer 500')
+    parser.add_argument('--queries', type=int, default=500, help='Search requests to time')
+    parser.add_argument('--workers', type=int, default=20, help='Crawler workers')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated web and queries')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Compare against the JSON results of an earlier run')
+    parser.add_argument('--keep', action='store_true', help='Keep the benchmark database and files')
+    args = parser.parse_args()
+
+    config = dotenv_values(".env")
+    missing = [k for k in ['DB_HOST', 'DB_USER', 'DB_PASSWORD', 'DB_NAME'] if k not in config]
+    if missing:
+        print(f"[ERROR]: Missing {', '.join(missing)} in .env file")
+        sys.exit(1)
+
+    report = run_benchmarks(config['DB_HOST'], config['DB_USER'], config['DB_PASSWORD'], config['DB_NAME'],
+                            pages=args.pages, out_degree=args.out_degree, hosts=args.hosts,
+                            page_size=args.page_size, latency=args.latency, error_rate=args.error_rate,
+                            queries=args.queries, workers=args.workers, seed=args.seed, keep=args.keep)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
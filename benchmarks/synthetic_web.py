@@ -0,0 +1,153 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functools import lru_cache
+import itertools
+import multiprocessing
+import random
+import threading
+import time
+
+SYLLABLES = ["ka", "lo", "mi", "nu", "re", "ta", "vo", "zi", "pa", "shi", "gu", "fe", "do", "ran", "tel", "qua"]
+
+
+def make_vocabulary(size):
+    """Pronounceable made-up words of 2+ syllables, so no real stop word or stem collides"""
+    words = []
+    for length in itertools.count(2):
+        for combo in itertools.product(SYLLABLES, repeat=length):
+            words.append("".join(combo))
+            if len(words) == size:
+                return words
+
+
+class SyntheticWeb:
+    """
+    A generated web graph, rendered on demand. Page i lives on host
+    i % hosts and links to page i + 1 (so every page is reachable from page
+    0) plus `out_degree - 1` random pages. Page text is drawn from a
+    Zipf-distributed vocabulary until the page is about `page_size` bytes.
+    Every page is a pure function of `seed`, so runs are reproducible.
+
+    A fraction `error_rate` of pages always answer 500, and every response
+    is delayed by `latency` seconds (+/- 50% jitter).
+    """
+
+    def __init__(self, pages=2000, out_degree=8, hosts=10, page_size=8 * 1024, latency=0.0, error_rate=0.0,
+                 vocabulary_size=5000, seed=1):
+        self.pages = pages
+        self.out_degree = out_degree
+        self.hosts = hosts
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.vocabulary = make_vocabulary(vocabulary_size)
+        self.cum_weights = list(itertools.accumulate(1.0 / rank for rank in range(1, vocabulary_size + 1)))
+        self.ports = []
+
+        self.port_queue = multiprocessing.Queue()
+        self.process = None
+
+    def host_of(self, page):
+        return page % self.hosts
+
+    def url(self, page):
+        return f"http://127.0.0.1:{self.ports[self.host_of(page)]}/page/{page}"
+
+    def is_broken(self, page):
+        return page != 0 and random.Random(f"{self.seed}-error-{page}").random() < self.error_rate
+
+    def words(self, rng, count):
+        return rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=count)
+
+    def links(self, page):
+        rng = random.Random(f"{self.seed}-links-{page}")
+        targets = [(page + 1) % self.pages]
+        targets += [rng.randrange(self.pages) for _ in range(self.out_degree - 1)]
+        return targets
+
+    @lru_cache(maxsize=100_000)
+    def render(self, page):
+        rng = random.Random(f"{self.seed}-page-{page}")
+        title = " ".join(self.words(rng, 4))
+        anchors = []
+        for target in self.links(page):
+            # Same-host links are relative, like most real sites
+            href = f"/page/{target}" if self.host_of(target) == self.host_of(page) else self.url(target)
+            anchors.append(f'<a href="{href}">{" ".join(self.words(rng, 2))}</a>')
+
+        head = f"<!DOCTYPE html><html><head><title>{title}</title></head><body><h1>{title}</h1>"
+        tail = "<ul>" + "".join(f"<li>{anchor}</li>" for anchor in anchors) + "</ul></body></html>"
+        paragraphs = []
+        size = len(head) + len(tail)
+        while size < self.page_size:
+            paragraph = "<p>" + " ".join(self.words(rng, 60)) + "</p>"
+            paragraphs.append(paragraph)
+            size += len(paragraph)
+        return (head + "".join(paragraphs) + tail).encode("utf-8")
+
+    def _serve(self):
+        """Runs in the server process: one HTTP server per host"""
+        web = self
+
+        class PageHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like a real server
+
+            def do_GET(self):
+                if web.latency:
+                    time.sleep(web.latency * random.uniform(0.5, 1.5))
+
+                page = None
+                if self.path.startswith("/page/"):
+                    try:
+                        page = int(self.path[len("/page/"):])
+                    except ValueError:
+                        pass
+                host = host_by_port[self.server.server_port]
+                if page is None or not 0 <= page < web.pages or web.host_of(page) != host:
+                    self.send_error(404)
+                    return
+                if web.is_broken(page):
+                    self.send_error(500)
+                    return
+
+                body = web.render(page)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        servers = []
+        for _ in range(self.hosts):
+            server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+            server.daemon_threads = True
+            servers.append(server)
+        self.ports = [server.server_port for server in servers]
+        host_by_port = {port: host for host, port in enumerate(self.ports)}
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        self.port_queue.put(self.ports)
+        threading.Event().wait()
+
+    def start(self):
+        """Serve the graph from a separate process, so it does not compete with the code under test for the GIL"""
+        self.process = multiprocessing.get_context("fork").Process(target=self._serve, name="synthetic-web",
+                                                                   daemon=True)
+        self.process.start()
+        self.ports = self.port_queue.get(timeout=30)
+        print(f"[BENCH]: Serving {self.pages} pages on {self.hosts} hosts (ports {self.ports[0]}..{self.ports[-1]})")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def query_terms(self, count, terms_per_query=2):
+        """Reproducible queries mixing common and rare terms of the vocabulary"""
+        rng = random.Random(f"{self.seed}-queries")
+        return [" ".join(self.words(rng, terms_per_query)) for _ in range(count)]
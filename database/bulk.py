@@ -0,0 +1,150 @@
+from mysql.connector import Error
+import os
+
+# LOCAL INFILE refused: disabled on the server (3948), by an older server
+# (1148), or by the client's allow_local_infile (2068)
+INFILE_REFUSED = {3948, 1148, 2068}
+
+# LOAD DATA escapes (ESCAPED BY '\\'): backslash first, then the bytes that
+# would otherwise end a field or a line
+ESCAPES = [(b"\\", b"\\\\"), (b"\t", b"\\t"), (b"\n", b"\\n"), (b"\r", b"\\r"), (b"\0", b"\\0")]
+UNESCAPES = {b"\\": b"\\", b"t": b"\t", b"n": b"\n", b"r": b"\r", b"0": b"\0"}
+NULL = b"\\N"
+
+
+def encode_field(value):
+    if value is None:
+        return NULL
+    if isinstance(value, bytes):
+        data = value
+    else:
+        data = str(value).encode("utf-8")
+    for raw, escaped in ESCAPES:
+        data = data.replace(raw, escaped)
+    return data
+
+
+def decode_field(data):
+    if data == NULL:
+        return None
+    if b"\\" not in data:
+        return data
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        if data[i:i + 1] == b"\\" and i + 1 < len(data):
+            out += UNESCAPES.get(data[i + 1:i + 2], data[i + 1:i + 2])
+            i += 2
+        else:
+            out += data[i:i + 1]
+            i += 1
+    return bytes(out)
+
+
+class BulkLoader:
+    """
+    Stages rows for one table in a local tab-separated file and loads them
+    with a single LOAD DATA LOCAL INFILE once `chunk_rows` have built up.
+
+    The load runs with foreign key checks off for its session, also after
+    a reconnect. If LOCAL INFILE is refused, the staged rows are sent as
+    multi-row INSERTs of `insert_rows` each, for this and later loads; any
+    other error fails only this load.
+    """
+
+    def __init__(self, db, table_name, columns, path, chunk_rows=1_000_000, insert_rows=5000):
+        self.db = db
+        self.table_name = table_name
+        self.columns = columns
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.insert_rows = insert_rows
+        self.use_infile = True
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "wb")
+        self.staged_rows = 0
+        self.staged_pages = set()
+        self.loaded_rows = 0
+
+    def add(self, row, page_id=None):
+        """Stage one row (a tuple in `columns` order); page_id tracks which pages wait for the load"""
+        self.file.write(b"\t".join(encode_field(value) for value in row) + b"\n")
+        self.staged_rows += 1
+        if page_id is not None:
+            self.staged_pages.add(page_id)
+
+    def full(self):
+        return self.staged_rows >= self.chunk_rows
+
+    def _load_infile(self):
+        self.db.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {self.table_name} CHARACTER SET binary "
+            f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({', '.join(self.columns)})",
+            (os.path.abspath(self.path),),
+            commit=True
+        )
+
+    def _load_inserts(self):
+        placeholders = "(" + ", ".join(["%s"] * len(self.columns)) + ")"
+        rows = []
+
+        def send():
+            sql = (f"INSERT INTO {self.table_name} ({', '.join(self.columns)}) "
+                   f"VALUES {', '.join([placeholders] * len(rows))}")
+            self.db.execute(sql, [value for row in rows for value in row])
+            rows.clear()
+
+        with open(self.path, "rb") as f:
+            for line in f:
+                rows.append([decode_field(field) for field in line.rstrip(b"\n").split(b"\t")])
+                if len(rows) >= self.insert_rows:
+                    send()
+        if rows:
+            send()
+        # One commit, so a failure part way leaves nothing half loaded
+        self.db.connection.commit()
+
+    def load(self):
+        """Load everything staged so far; returns False if the rows could not be loaded"""
+        if not self.staged_rows:
+            return True
+
+        self.file.flush()
+        print(f"[BULK]: Loading {self.staged_rows} rows into '{self.table_name}'")
+        try:
+            with self.db.session("SET foreign_key_checks = 0"):
+                if self.use_infile:
+                    try:
+                        self._load_infile()
+                    except Error as e:
+                        if e.errno not in INFILE_REFUSED:
+                            raise
+                        print(f"[BULK]: LOAD DATA LOCAL INFILE unavailable ({e}), using multi-row inserts")
+                        self.use_infile = False
+                if not self.use_infile:
+                    self._load_inserts()
+        except Error as e:
+            print(f"[BULK]: Error while loading '{self.table_name}': {e}")
+            try:
+                self.db.connection.rollback()
+            except Error:
+                pass
+            return False
+        finally:
+            try:
+                self.db.execute("SET foreign_key_checks = 1")
+            except Error:
+                pass
+
+        self.loaded_rows += self.staged_rows
+        self.staged_rows = 0
+        self.staged_pages = set()
+        self.file.seek(0)
+        self.file.truncate()
+        return True
+
+    def close(self):
+        self.file.close()
+        os.remove(self.path)
@@ -1,15 +1,58 @@
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
+from contextlib import contextmanager
+import queue
+import threading
+import time
+
+# Client error codes meaning the connection itself is gone (server gone
+# away, lost during query, lost during handshake), not that the SQL failed
+CONNECTION_LOST = {2006, 2013, 2055}
+
+# Server errors that say nothing about the statement: lock wait timeout, deadlock
+SERVER_BUSY = {1205, 1213}
+
+
+def is_transient(error):
+    """Whether an Error came from the connection or server state rather than the SQL or its data"""
+    errno = getattr(error, "errno", None)
+    # 2000-2999 are client errors: no connection, lost connection, pool exhausted
+    return errno is None or errno < 1000 or 2000 <= errno < 3000 or errno in SERVER_BUSY
+
 
 class DatabaseController:
+    """
+    MySQL access for the crawler, indexer and search server.
+
+    Connections come from a pool of at most `pool_size`. Every thread that
+    touches `connection` gets its own one, bound to it until release(), so
+    threads never share a socket; checkout() lends an extra connection for
+    a block of work. Pooled connections idle for longer than
+    `health_check_interval` are pinged before reuse, and statements run
+    through execute() are retried on a reconnected socket when the server
+    goes away, as long as re-running them cannot apply a write twice.
+    """
 
-    def __init__(self, host, user, password, database=None):
+    def __init__(self, host, user, password, database=None, pool_size=5, pool_timeout=30.0, retries=3,
+                 retry_delay=0.5, health_check_interval=30.0, allow_local_infile=False, connect=True):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
-        self.connection = None
-        self.connect()  # Connect once upon instantiation
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.health_check_interval = health_check_interval
+        self.allow_local_infile = allow_local_infile  # Needed for LOAD DATA LOCAL INFILE (database/bulk.py)
+
+        self.idle = queue.LifoQueue()  # (connection, last used), most recently used first
+        self.opened = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        if connect:
+            self.connect()  # Connect once upon instantiation
 
     def connect(self):
         try:
@@ -25,70 +68,369 @@ class DatabaseController:
             temp_cursor.close()
             temp_conn.close()
 
-            # Now connect to the actual DB and store the connection
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database
-            )
+            # Bind the first pooled connection to this thread
             if self.connection.is_connected():
                 print(f"[DATABASE]: Connected to database '{self.database}'")
 
         except Error as e:
             print(f"[DATABASE]: Error while connecting to MySQL: {e}")
 
+    def _open(self):
+        for attempt in range(self.retries + 1):
+            try:
+                return mysql.connector.connect(
+                    host=self.host,
+                    user=self.user,
+                    password=self.password,
+                    database=self.database,
+                    allow_local_infile=self.allow_local_infile
+                )
+            except Error as e:
+                if attempt == self.retries:
+                    raise
+                print(f"[DATABASE]: Connection attempt {attempt + 1} failed, retrying: {e}")
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def _acquire(self):
+        """Take an idle connection, open a new one while under pool_size, or wait for one"""
+        try:
+            conn, last_used = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = len(self.opened) < self.pool_size
+                if can_open:
+                    self.opened.append(None)  # Reserve the slot before connecting
+            if can_open:
+                try:
+                    conn = self._open()
+                except Error:
+                    with self.lock:
+                        self.opened.remove(None)
+                    raise
+                with self.lock:
+                    self.opened[self.opened.index(None)] = conn
+                return conn
+            try:
+                conn, last_used = self.idle.get(timeout=self.pool_timeout)
+            except queue.Empty:
+                raise PoolError(f"No connection free after {self.pool_timeout} seconds (pool size {self.pool_size})")
+
+        if time.monotonic() - last_used > self.health_check_interval:
+            conn.ping(reconnect=True, attempts=self.retries, delay=self.retry_delay)
+        return conn
+
+    def _return(self, conn):
+        self.idle.put((conn, time.monotonic()))
+
+    @property
+    def connection(self):
+        """The calling thread's own connection, checked out on first use"""
+        conn = getattr(self.local, "connection", None)
+        if conn is None:
+            conn = self._acquire()
+            self.local.connection = conn
+        return conn
+
+    def release(self):
+        """Give the calling thread's connection back to the pool"""
+        conn = getattr(self.local, "connection", None)
+        if conn is not None:
+            self.local.connection = None
+            self._return(conn)
+
+    @contextmanager
+    def checkout(self):
+        """Borrow a pooled connection, separate from the thread's own, for a block of work"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._return(conn)
+
+    @contextmanager
+    def session(self, *statements):
+        """
+        Run session statements (e.g. SET foreign_key_checks = 0) on the
+        thread's connection for a block, re-running them whenever execute()
+        reconnects, since a new session starts from the server defaults
+        """
+        for statement in statements:
+            self.execute(statement)
+        self.local.session = statements
+        try:
+            yield
+        finally:
+            self.local.session = ()
+
+    def execute(self, sql, params=None, many=False, dictionary=False, fetch=False, commit=False, idempotent=False):
+        """
+        Run one statement on the thread's connection and return its rows if
+        `fetch`. If the connection is lost, reconnect and run it again when
+        that is safe: for reads, and for statements that commit themselves
+        and failed before the commit. A commit that failed may still have
+        gone through, so it is only retried for `idempotent` statements
+        (upserts). Anything else raises once the connection is reopened.
+        """
+        for attempt in range(self.retries + 1):
+            conn = self.connection
+            committing = False
+            try:
+                cursor = conn.cursor(dictionary=dictionary)
+                try:
+                    if many:
+                        cursor.executemany(sql, params)
+                    else:
+                        cursor.execute(sql, params)
+                    rows = cursor.fetchall() if fetch else None
+                finally:
+                    cursor.close()
+                if commit:
+                    committing = True
+                    conn.commit()
+                return rows
+            except Error as e:
+                if e.errno not in CONNECTION_LOST and conn.is_connected():
+                    raise
+                # Part of a caller's transaction, or a commit whose outcome is unknown
+                retry = fetch or (commit and (idempotent or not committing))
+                print(f"[DATABASE]: Connection lost, reconnecting: {e}")
+                conn.reconnect(attempts=self.retries, delay=self.retry_delay)
+                self._restore_session(conn)
+                if attempt == self.retries or not retry:
+                    raise
+
+    def _restore_session(self, conn):
+        statements = getattr(self.local, "session", ())
+        if statements:
+            cursor = conn.cursor()
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+            finally:
+                cursor.close()
+
+    def clone(self):
+        """
+        A second, independent controller (and pool) for the same database. The
+        database already exists, so it skips connect() and opens connections
+        only as they are used.
+        """
+        return DatabaseController(self.host, self.user, self.password, self.database, pool_size=self.pool_size,
+                                  pool_timeout=self.pool_timeout, retries=self.retries, retry_delay=self.retry_delay,
+                                  health_check_interval=self.health_check_interval,
+                                  allow_local_infile=self.allow_local_infile, connect=False)
+
     def close(self):
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            print("Connection closed")
+        with self.lock:
+            opened, self.opened = [conn for conn in self.opened if conn is not None], []
+        self.local = threading.local()
+        self.idle = queue.LifoQueue()
+        for conn in opened:
+            try:
+                if conn.is_connected():
+                    conn.close()
+            except Error:
+                pass
+        print("Connection closed")
 
     def create_table(self, table_name, columns):
         try:
-            cursor = self.connection.cursor()
             columns_with_types = ", ".join([f"{col} {dtype}" for col, dtype in columns.items()])
-            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_with_types})")
+            self.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_with_types})")
             print(f"[DATABASE]: Table '{table_name}' created or already exists.")
-            cursor.close()
         except Error as e:
             print(f"[DATABASE]: Error while creating table: {e}")
     
+    def get_columns(self, table_name):
+        """Return the set of column names of a table"""
+        try:
+            rows = self.execute(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+                (self.database, table_name),
+                fetch=True
+            )
+            return {row[0] for row in rows}
+        except Error as e:
+            print(f"[DATABASE]: Error while reading columns: {e}")
+            return set()
+
+    def add_missing_columns(self, table_name, columns):
+        """Add columns that were introduced after the table was first created"""
+        existing = self.get_columns(table_name)
+        try:
+            for col, dtype in columns.items():
+                if col not in existing:
+                    self.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} {dtype}")
+                    print(f"[DATABASE]: Added column '{col}' to '{table_name}'")
+        except Error as e:
+            print(f"[DATABASE]: Error while adding columns: {e}")
+
+    def get_indexes(self, table_name):
+        """Return the set of secondary (non-unique) index names of a table"""
+        try:
+            rows = self.execute(
+                "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND NON_UNIQUE = 1",
+                (self.database, table_name),
+                fetch=True
+            )
+            return {row[0] for row in rows}
+        except Error as e:
+            print(f"[DATABASE]: Error while reading indexes: {e}")
+            return set()
+
+    def add_missing_indexes(self, table_name, indexes):
+        """Create indexes ({name: "(col, ...)"}) that a table does not have"""
+        existing = self.get_indexes(table_name)
+        try:
+            for name, columns in indexes.items():
+                if name not in existing:
+                    print(f"[DATABASE]: Building index '{name}' on '{table_name}'")
+                    self.execute(f"ALTER TABLE {table_name} ADD INDEX {name} {columns}")
+        except Error as e:
+            print(f"[DATABASE]: Error while adding indexes: {e}")
+
+    def drop_indexes(self, table_name, names):
+        """Drop the named secondary indexes that exist"""
+        existing = self.get_indexes(table_name)
+        try:
+            for name in names:
+                if name in existing:
+                    self.execute(f"ALTER TABLE {table_name} DROP INDEX {name}")
+                    print(f"[DATABASE]: Dropped index '{name}' on '{table_name}'")
+        except Error as e:
+            print(f"[DATABASE]: Error while dropping indexes: {e}")
+
+    def modify_column(self, table_name, column, dtype):
+        """Change the definition of an existing column (e.g. to extend an ENUM)"""
+        try:
+            self.execute(f"ALTER TABLE {table_name} MODIFY COLUMN {column} {dtype}")
+        except Error as e:
+            print(f"[DATABASE]: Error while modifying column: {e}")
+
     def insert_many(self, table_name, data_list):
         try:
             if not data_list:
                 return
 
             print(f"[DATABASE]: Inserting {len(data_list)} rows into '{table_name}' table")
-            cursor = self.connection.cursor()
 
             columns = ", ".join(data_list[0].keys())
             placeholders = ", ".join(["%s"] * len(data_list[0]))
             sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
 
             values = [tuple(data.values()) for data in data_list]
-            cursor.executemany(sql, values)
-
-            self.connection.commit()
+            # Not retried if the connection drops during the commit, which could insert the rows twice
+            self.execute(sql, values, many=True, commit=True)
             print(f"[DATABASE]: {len(data_list)} rows inserted into '{table_name}' table.")
-            cursor.close()
         except Error as e:
             print(f"Error during batch insert: {e}")
             
 
+    def upsert_many(self, table_name, data_list, updates=None, raise_errors=False):
+        """
+        Insert rows with a single multi-row statement, updating existing rows
+        on duplicate keys. `updates` maps column -> SQL expression; by default
+        every non-key column takes the new value. With `raise_errors` a
+        failure is raised instead of returning False.
+        """
+        try:
+            if not data_list:
+                return True
+
+            columns = list(data_list[0].keys())
+            row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+            if updates is None:
+                updates = {col: f"VALUES({col})" for col in columns}
+            assignments = ", ".join(f"{col} = {expr}" for col, expr in updates.items())
+
+            sql = (f"INSERT INTO {table_name} ({', '.join(columns)}) "
+                   f"VALUES {', '.join([row_placeholder] * len(data_list))} "
+                   f"ON DUPLICATE KEY UPDATE {assignments}")
+            values = [data[col] for data in data_list for col in columns]
+            self.execute(sql, values, commit=True, idempotent=True)
+            return True
+        except Error as e:
+            print(f"[DATABASE]: Error during batch upsert into '{table_name}': {e}")
+            if raise_errors:
+                raise
+            return False
+
     def fetch_batch(self, table_name, batch_size=100, offset=0, where_clause=None):
         query = f"SELECT * FROM {table_name}"
         if where_clause:
             query += f" WHERE {where_clause}"
         query += f" LIMIT {batch_size} OFFSET {offset}"
         try:
-            cursor = self.connection.cursor(dictionary=True)
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            cursor.close()
-            return rows
+            return self.execute(query, dictionary=True, fetch=True)
         except Error as e:
             print(f"[DATABASE]: Error fetching batch: {e}")
             return []
 
         
 
+
+
+    def stream_rows(self, table_name, batch_size=1000, where_clause=None, columns="*", key="id",
+                    start_after=None, unbuffered=False):
+        """
+        Yield rows in primary-key order.
+
+        By default each batch is a keyset query (`WHERE key > last_key ORDER BY
+        key LIMIT n`), so every batch costs the same no matter how far in the
+        scan is, and rows changing underneath do not shift later batches.
+        With `unbuffered=True` the whole scan is a single query read through a
+        server-side cursor on a separate connection, leaving this controller
+        free for writes while the stream is consumed. A failed query is
+        raised, so callers never mistake a broken scan for the end of the table.
+        """
+        conditions = [f"({where_clause})"] if where_clause else []
+
+        if unbuffered:
+            if start_after is not None:
+                conditions.append(f"{key} > %s")
+            query = f"SELECT {columns} FROM {table_name}"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += f" ORDER BY {key}"
+
+            stream_db = self.clone()
+            try:
+                cursor = stream_db.connection.cursor(dictionary=True, buffered=False)
+                cursor.execute(query, () if start_after is None else (start_after,))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+                cursor.close()
+            except Error as e:
+                print(f"[DATABASE]: Error streaming rows: {e}")
+                raise
+            finally:
+                stream_db.close()
+            return
+
+        last_key = start_after
+        while True:
+            batch_conditions = list(conditions)
+            params = ()
+            if last_key is not None:
+                batch_conditions.append(f"{key} > %s")
+                params = (last_key,)
+
+            query = f"SELECT {columns} FROM {table_name}"
+            if batch_conditions:
+                query += " WHERE " + " AND ".join(batch_conditions)
+            query += f" ORDER BY {key} LIMIT {batch_size}"
+
+            try:
+                rows = self.execute(query, params, dictionary=True, fetch=True)
+            except Error as e:
+                print(f"[DATABASE]: Error streaming rows: {e}")
+                raise
+
+            if not rows:
+                return
+            yield from rows
+            last_key = rows[-1][key]
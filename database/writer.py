@@ -0,0 +1,163 @@
+from database.db import is_transient
+from mysql.connector import Error
+from services.common.metrics import STAGE_SECONDS, ROWS_WRITTEN, QUEUE_DEPTH
+import queue
+import threading
+import time
+
+
+class _Sync:
+    """Marker queued by GroupCommitWriter.sync()"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.committed = False
+
+
+class GroupCommitWriter:
+    """
+    Background writer that coalesces row writes for one table and commits
+    them as multi-row upserts. A flush happens when `batch_size` rows are
+    waiting or `flush_interval` seconds have passed, whichever comes first.
+
+    The writer owns its own connection so callers never block on MySQL.
+    Rows are keyed on `key_column`; a later write for the same key replaces
+    an earlier one that has not been flushed yet.
+
+    A batch that fails because of the connection (or a deadlock) stays
+    pending and is retried on later flushes, which back off up to
+    `max_backoff` seconds apart. A batch that MySQL rejects is split in
+    halves until the rows that fail on their own data are isolated, and
+    those are logged and dropped.
+
+    `on_commit(rows)` is called on the writer thread with every batch of
+    rows once it is committed.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db, table_name, key_column, updates=None, batch_size=500, flush_interval=1.0,
+                 component="writer", max_backoff=30.0, on_commit=None):
+        self.db = db
+        self.table_name = table_name
+        self.key_column = key_column
+        self.updates = updates
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.component = component  # Metrics label
+        self.max_backoff = max_backoff
+        self.on_commit = on_commit
+
+        self.rows = queue.Queue()
+        self.pending = {}
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+
+        self.thread = threading.Thread(target=self._run, name=f"{table_name}-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, row):
+        """Queue a row for the next group commit"""
+        self.rows.put(row)
+
+    def _write(self, batch):
+        """
+        Commit a batch and take its rows out of pending. Returns False if
+        MySQL rejected the rows; connection errors are raised.
+        """
+        try:
+            self.db.upsert_many(self.table_name, batch, self.updates, raise_errors=True)
+        except Error as e:
+            if is_transient(e):
+                raise
+            return False
+        for row in batch:
+            del self.pending[row[self.key_column]]
+        self.flushed_rows += len(batch)
+        ROWS_WRITTEN.inc(self.component, self.table_name, amount=len(batch))
+        if self.on_commit is not None:
+            self.on_commit(batch)
+        return True
+
+    def _write_split(self, batch):
+        """Write a batch in halves, dropping the rows that cannot be written on their own"""
+        if self._write(batch):
+            return
+        if len(batch) == 1:
+            self.dropped_rows += 1
+            del self.pending[batch[0][self.key_column]]
+            print(f"[DATABASE]: Dropping row for '{self.table_name}' that cannot be written: "
+                  f"{batch[0][self.key_column]!r}")
+            return
+        middle = len(batch) // 2
+        self._write_split(batch[:middle])
+        self._write_split(batch[middle:])
+
+    def _flush(self):
+        if not self.pending:
+            return
+        batch = list(self.pending.values())
+        QUEUE_DEPTH.set(len(batch) + self.rows.qsize(), self.component, f"{self.table_name}_writer")
+        start = time.perf_counter()
+        try:
+            if not self._write(batch):
+                print(f"[DATABASE]: Batch for '{self.table_name}' was rejected; splitting it to isolate bad rows")
+                self._write_split(batch)
+            self.failed_flushes = 0
+        except Error as e:
+            # Rows that were not committed stay pending for the next flush
+            self.failed_flushes += 1
+            print(f"[DATABASE]: {len(self.pending)} rows for '{self.table_name}' kept pending "
+                  f"(failed flush {self.failed_flushes}): {e}")
+        STAGE_SECONDS.observe(time.perf_counter() - start, self.component, "db_write")
+
+    def _next_flush(self):
+        """Seconds until the next timed flush, longer after each failed one"""
+        return min(self.flush_interval * 2 ** min(self.failed_flushes, 10), max(self.flush_interval, self.max_backoff))
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                row = self.rows.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                row = None
+
+            if row is self._STOP:
+                # One last attempt; if the database is down the rows are reported, not waited on
+                self._flush()
+                return
+
+            if isinstance(row, _Sync):
+                dropped = self.dropped_rows
+                self._flush()
+                row.committed = not self.pending and self.dropped_rows == dropped
+                row.done.set()
+                continue
+
+            if row is not None:
+                self.pending[row[self.key_column]] = row
+
+            # While the database is failing only timed flushes run, so rows arriving do not hammer it
+            full = len(self.pending) >= self.batch_size and not self.failed_flushes
+            if full or time.monotonic() >= deadline:
+                self._flush()
+                deadline = time.monotonic() + self._next_flush()
+
+    def sync(self, timeout=None):
+        """Flush everything submitted so far; True once all of it is committed and none of it was dropped"""
+        marker = _Sync()
+        self.rows.put(marker)
+        return marker.done.wait(timeout) and marker.committed
+
+    def close(self):
+        """Flush everything submitted so far and stop the writer thread; True if every row was written"""
+        self.rows.put(self._STOP)
+        self.thread.join()
+        if self.pending:
+            print(f"[DATABASE]: {len(self.pending)} rows for '{self.table_name}' could not be written")
+        if self.dropped_rows:
+            print(f"[DATABASE]: {self.dropped_rows} rows for '{self.table_name}' were dropped")
+        self.db.close()
+        return not self.pending and not self.dropped_rows
@@ -3,6 +3,9 @@ import argparse
 from dotenv import dotenv_values
 from services.indexer.indexer import run_indexer
 from services.spider.crawler import run_crawler
+from services.indexer.segment import run_index_export
+from services.indexer.query import run_search_server
+from services.indexer.pagerank import run_pagerank
 
 def main():
     config = dotenv_values(".env")
@@ -13,14 +16,52 @@ def main():
         sys.exit(1)
 
     parser = argparse.ArgumentParser(description="Run parts of the Search Engine project.")
-    parser.add_argument('task', choices=['indexer', 'crawler'], help='Task to run')
+    parser.add_argument('task', choices=['indexer', 'crawler', 'export-index', 'search-server', 'pagerank'], help='Task to run')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads',
+                        help='Crawler engine: batched thread pool or asyncio sliding window')
+    parser.add_argument('--visited-filter', choices=['exact', 'fingerprint', 'bloom'], default='exact',
+                        help='How the crawler remembers visited URLs')
+    parser.add_argument('--parser', choices=['stream', 'lxml', 'soup'], default='stream',
+                        help='HTML parser backend for the crawler and indexer')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Crawler: split hosts across this many crawler processes')
+    parser.add_argument('--shard-index', type=int, default=None,
+                        help='Crawler: run only this shard (multi-machine crawl against a shared database)')
+    parser.add_argument('--reindex', action='store_true',
+                        help='Indexer: refetch indexed pages and reindex the ones that changed')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='Indexer: stage postings in a file and load them in large chunks (initial builds)')
+    parser.add_argument('--duplicate-distance', type=int, default=3,
+                        help='Indexer: max SimHash bit distance for a page to count as a near duplicate '
+                             '(negative to disable)')
+    parser.add_argument('--pagerank-weight', type=float, default=1.0,
+                        help='Search server: weight of the PageRank score added to BM25 (0 to disable)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Crawler/indexer: record metrics and serve them on this port (/metrics, /metrics.json)')
+    parser.add_argument('--metrics-dump', default=None,
+                        help='Crawler/indexer: record metrics and write them as JSON to this file on exit')
     args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shard_index is not None and not 0 <= args.shard_index < args.shards:
+        parser.error(f"--shard-index must be between 0 and {args.shards - 1}")
 
     params = (config['DB_HOST'], config['DB_USER'], config['DB_PASSWORD'], config['DB_NAME'])
     if args.task == 'indexer':
-        run_indexer(*params)
+        run_indexer(*params, reindex=args.reindex, bulk_load=args.bulk_load,
+                    duplicate_distance=args.duplicate_distance if args.duplicate_distance >= 0 else None,
+                    parser=args.parser, metrics_port=args.metrics_port, metrics_dump=args.metrics_dump)
+    elif args.task == 'export-index':
+        run_index_export(*params)
+    elif args.task == 'search-server':
+        run_search_server(*params, port=int(config.get('SEARCH_ENGINE_PORT') or 5001),
+                          pagerank_weight=args.pagerank_weight)
+    elif args.task == 'pagerank':
+        run_pagerank(*params)
     else:
-        run_crawler(*params)
+        run_crawler(*params, engine=args.engine, visited_filter=args.visited_filter,
+                    shards=args.shards, shard_index=args.shard_index, parser=args.parser,
+                    metrics_port=args.metrics_port, metrics_dump=args.metrics_dump)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Thread-safe LRU map with an optional TTL. The size budget counts
+    entries, or the sum of weigh(value) when `weigh` is given (e.g. the
+    number of postings held). Entries are tagged with the generation they
+    were computed for and are dropped when looked up under another one.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, weigh=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.weigh = weigh
+        self.entries = OrderedDict()  # key -> (value, generation, expires, weight)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, generation=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, entry_generation, expires, weight = entry
+                if entry_generation == generation and (expires is None or expires > time.monotonic()):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.size -= weight
+            self.misses += 1
+            return None
+
+    def put(self, key, value, generation=None):
+        weight = self.weigh(value) if self.weigh else 1
+        if weight > self.max_size:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[3]
+            self.entries[key] = (value, generation, expires, weight)
+            self.size += weight
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted[3]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,133 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import namedtuple
+from urllib.parse import urljoin
+from services.common.metrics import STAGE_SECONDS, PAGES, BYTES_FETCHED
+from services.common.host_cache import CachedDNSAdapter
+import time
+
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+# content is the raw (transfer-decoded) body, cut at the fetcher's byte cap when truncated is True
+FetchResult = namedtuple("FetchResult", ["url", "status_code", "headers", "content", "truncated"])
+
+
+class RejectedResponse(Exception):
+    """A response that was dropped from its headers, before its body was read"""
+
+
+def create_session(pool_connections=10, pool_maxsize=10, host_cache=None):
+    """
+    Session with retries and the user agent shared by the crawler and
+    indexer. With a HostCache, new connections resolve through its DNS cache.
+    """
+    session = requests.Session()
+    retry_strategy = Retry(
+        total=3,
+        backoff_factor=0.1,
+        status_forcelist=[429, 500, 502, 503, 504]
+    )
+    adapter_args = {
+        "max_retries": retry_strategy,
+        "pool_connections": pool_connections,
+        "pool_maxsize": pool_maxsize
+    }
+    if host_cache is not None:
+        adapter = CachedDNSAdapter(host_cache, **adapter_args)
+    else:
+        adapter = HTTPAdapter(**adapter_args)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/115.0.0.0 Safari/537.36"
+    })
+
+    return session
+
+
+class Fetcher:
+    """
+    Streams page bodies instead of downloading them whole. Responses whose
+    Content-Type is not HTML are rejected from the headers alone, and at
+    most `max_bytes` of a body are read (after gzip/deflate decoding, so a
+    compressed response cannot expand past the cap either).
+
+    With a HostCache, URLs its robots.txt rules disallow are rejected
+    before any request is sent. Redirects are followed here rather than by
+    requests, so every hop is checked the same way.
+    """
+
+    def __init__(self, session, timeout=5, max_bytes=2 * 1024 * 1024, chunk_size=64 * 1024,
+                 content_types=HTML_TYPES, component="fetch", host_cache=None):
+        self.session = session
+        self.host_cache = host_cache
+        self.component = component  # Metrics label: "crawler" or "indexer"
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.content_types = content_types
+
+    def check_headers(self, response):
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        # Servers that send no Content-Type get the benefit of the doubt
+        if content_type and content_type not in self.content_types:
+            raise RejectedResponse(f"Unsupported content type: {content_type}")
+
+    def _open(self, url, headers):
+        """Send the request and follow its redirects, checking each URL against robots.txt first"""
+        for _ in range(self.session.max_redirects + 1):
+            if self.host_cache is not None and not self.host_cache.allowed(url, self.session):
+                PAGES.inc(self.component, "disallowed")
+                raise RejectedResponse(f"Disallowed by robots.txt: {url}")
+            response = self.session.get(url, timeout=self.timeout, headers=headers, allow_redirects=False,
+                                        stream=True)
+            target = self.session.get_redirect_target(response)
+            if target is None:
+                return response
+            response.close()
+            url = urljoin(response.url, target)
+        raise requests.TooManyRedirects(f"Exceeded {self.session.max_redirects} redirects", response=response)
+
+    def get(self, url, headers=None):
+        """
+        Fetch a page; raises RejectedResponse for non-HTML and URLs disallowed
+        by robots.txt, and HTTPError for error statuses
+        """
+        # With stream=True this returns once the headers are in: DNS, connect and time to first byte
+        start = time.perf_counter()
+        response = self._open(url, headers)
+        headers_done = time.perf_counter()
+        STAGE_SECONDS.observe(headers_done - start, self.component, "fetch_headers")
+        try:
+            if response.status_code == 304:
+                PAGES.inc(self.component, "not_modified")
+                return FetchResult(response.url, 304, response.headers, b"", False)
+            response.raise_for_status()
+            try:
+                self.check_headers(response)
+            except RejectedResponse:
+                PAGES.inc(self.component, "rejected")
+                raise
+
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(self.chunk_size):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= self.max_bytes:
+                    break
+
+            content = b"".join(chunks)
+            truncated = size >= self.max_bytes
+            STAGE_SECONDS.observe(time.perf_counter() - headers_done, self.component, "fetch_body")
+            BYTES_FETCHED.inc(self.component, amount=min(size, self.max_bytes))
+            PAGES.inc(self.component, "truncated" if truncated else "fetched")
+            return FetchResult(response.url, response.status_code, response.headers,
+                               content[:self.max_bytes], truncated)
+        finally:
+            # Hands a fully read connection back to the pool; an abandoned one is closed
+            response.close()
@@ -0,0 +1,268 @@
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib.parse import urlparse
+from services.common.cache import LRUCache
+from services.common.metrics import HOST_CACHE
+import ipaddress
+import re
+import socket
+import threading
+import time
+
+
+class RobotsRules:
+    """
+    Allow/Disallow rules of one robots.txt group, compiled for matching.
+    Rules are sorted longest pattern first (Allow before Disallow on a
+    tie), so the first rule that matches a path decides it, as in RFC 9309.
+    """
+
+    def __init__(self, rules=(), crawl_delay=None):
+        compiled = []
+        for pattern, allow in rules:
+            if "*" in pattern or pattern.endswith("$"):
+                anchored = pattern.endswith("$")
+                body = re.escape(pattern[:-1] if anchored else pattern).replace(r"\*", ".*")
+                match = re.compile(body + ("$" if anchored else "")).match
+            else:
+                # Plain prefixes, by far the most common rules, skip the regex engine
+                match = lambda path, prefix=pattern: path.startswith(prefix)
+            compiled.append((len(pattern), allow, match))
+        compiled.sort(key=lambda rule: (-rule[0], not rule[1]))
+        self.rules = [(allow, match) for _, allow, match in compiled]
+        self.crawl_delay = crawl_delay
+
+    def allowed(self, path):
+        for allow, match in self.rules:
+            if match(path):
+                return allow
+        return True
+
+
+def parse_robots(text, agent="*"):
+    """
+    Compile the group of a robots.txt that applies to `agent` (a product
+    token such as "searchbot"), falling back to the "*" group
+    """
+    agent = agent.lower()
+    groups = []  # [(user agents, rules, crawl delay)]
+    current = None
+    in_agents = False
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if ":" not in line:
+            continue
+        field, value = line.split(":", 1)
+        field = field.strip().lower()
+        value = value.strip()
+
+        if field == "user-agent":
+            # Consecutive User-agent lines share one group
+            if not in_agents:
+                current = (set(), [], [])
+                groups.append(current)
+                in_agents = True
+            current[0].add(value.lower())
+            continue
+        in_agents = False
+        if current is None:
+            continue
+        if field in ("allow", "disallow"):
+            # An empty Disallow allows everything and adds no rule
+            if value:
+                current[1].append((value, field == "allow"))
+        elif field == "crawl-delay":
+            try:
+                current[2].append(float(value))
+            except ValueError:
+                pass
+
+    selected = [group for group in groups if agent != "*" and agent in group[0]]
+    if not selected:
+        selected = [group for group in groups if "*" in group[0]]
+    rules = [rule for group in selected for rule in group[1]]
+    delays = [delay for group in selected for delay in group[2]]
+    return RobotsRules(rules, max(delays) if delays else None)
+
+
+ALLOW_ALL = RobotsRules()
+# For a host whose robots.txt could not be read in time; never cached
+DISALLOW_ALL = RobotsRules([("/", False)])
+
+
+class HostCache:
+    """
+    Per-host state shared by every fetch of a process: resolved addresses
+    (kept `dns_ttl` seconds, failures `failure_ttl`), robots.txt rules
+    fetched once per scheme and host (kept `robots_ttl` seconds), and the
+    crawl delay they ask for. Both caches are LRUs bounded at `max_hosts`.
+    """
+
+    def __init__(self, max_hosts=100_000, dns_ttl=300.0, failure_ttl=60.0, robots_ttl=24 * 3600.0,
+                 agent="*", robots=True, robots_timeout=5, max_robots_bytes=500 * 1024, max_crawl_delay=30.0):
+        self.addresses = LRUCache(max_hosts)  # (host, port) -> (expires, address, error)
+        self.robots_rules = LRUCache(max_hosts)  # scheme://host -> (expires, RobotsRules)
+        self.dns_ttl = dns_ttl
+        self.failure_ttl = failure_ttl
+        self.robots_ttl = robots_ttl
+        self.agent = agent
+        self.robots = robots  # False skips robots.txt entirely
+        self.robots_timeout = robots_timeout
+        self.max_robots_bytes = max_robots_bytes
+        self.max_crawl_delay = max_crawl_delay
+
+        # Hosts whose robots.txt is being fetched; other threads wait for it
+        self.robots_fetching = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """Address to connect to for host:port; raises socket.gaierror if it does not resolve"""
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+
+        key = (host, port)
+        now = time.monotonic()
+        entry = self.addresses.get(key)
+        if entry is not None and entry[0] > now:
+            HOST_CACHE.inc("dns", "hit")
+        else:
+            HOST_CACHE.inc("dns", "miss")
+            try:
+                infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+                entry = (now + self.dns_ttl, infos[0][4][0], None)
+            except socket.gaierror as e:
+                # Dead hosts are not looked up again for every one of their URLs
+                entry = (now + self.failure_ttl, None, e.args)
+            self.addresses.put(key, entry)
+
+        if entry[2] is not None:
+            raise socket.gaierror(*entry[2])
+        return entry[1]
+
+    def _cached_rules(self, key):
+        entry = self.robots_rules.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def rules_for(self, url, session):
+        """RobotsRules for a URL's host, fetching its robots.txt with `session` on first use"""
+        parsed = urlparse(url)
+        key = f"{parsed.scheme}://{parsed.netloc.lower()}"
+        rules = self._cached_rules(key)
+        if rules is not None:
+            HOST_CACHE.inc("robots", "hit")
+            return rules
+
+        while True:
+            with self.lock:
+                rules = self._cached_rules(key)
+                if rules is None:
+                    event = self.robots_fetching.get(key)
+                    owner = event is None
+                    if owner:
+                        event = self.robots_fetching[key] = threading.Event()
+            if rules is not None:
+                HOST_CACHE.inc("robots", "hit")
+                return rules
+            if owner:
+                break
+
+            # Another thread is fetching it. If that fetch ends without rules, try again ourselves;
+            # if it is still running, this URL is not crawled blind.
+            if not event.wait(self.robots_timeout * 2):
+                print(f"[Robots]: Timed out waiting for {key}/robots.txt; skipping {url}")
+                return DISALLOW_ALL
+
+        HOST_CACHE.inc("robots", "miss")
+        try:
+            rules, ttl = self._fetch_rules(key, session)
+            self.robots_rules.put(key, (time.monotonic() + ttl, rules))
+            return rules
+        finally:
+            with self.lock:
+                del self.robots_fetching[key]
+            event.set()
+
+    def _fetch_rules(self, key, session):
+        """Return (rules, seconds to keep them) for one scheme://host"""
+        try:
+            response = session.get(key + "/robots.txt", timeout=self.robots_timeout, allow_redirects=True,
+                                   stream=True)
+            try:
+                if response.status_code >= 500:
+                    print(f"[Robots]: {key}/robots.txt answered {response.status_code}; retrying later")
+                    return ALLOW_ALL, self.failure_ttl
+                if response.status_code != 200:
+                    # No robots.txt (4xx) means no restrictions
+                    return ALLOW_ALL, self.robots_ttl
+                body = b""
+                for chunk in response.iter_content(64 * 1024):
+                    body += chunk
+                    if len(body) >= self.max_robots_bytes:
+                        break
+            finally:
+                response.close()
+        except Exception as e:
+            print(f"[Robots]: Could not fetch {key}/robots.txt: {e}")
+            return ALLOW_ALL, self.failure_ttl
+
+        text = body[:self.max_robots_bytes].decode("utf-8-sig", errors="replace")
+        return parse_robots(text, self.agent), self.robots_ttl
+
+    def allowed(self, url, session):
+        """Whether robots.txt lets us fetch a URL"""
+        if not self.robots:
+            return True
+        parsed = urlparse(url)
+        path = (parsed.path or "/") + ("?" + parsed.query if parsed.query else "")
+        return self.rules_for(url, session).allowed(path)
+
+    def crawl_delay(self, url):
+        """Crawl-delay of a URL's host (capped at max_crawl_delay), if its robots.txt is cached"""
+        parsed = urlparse(url)
+        rules = self._cached_rules(f"{parsed.scheme}://{parsed.netloc.lower()}")
+        if rules is None or rules.crawl_delay is None:
+            return None
+        return min(rules.crawl_delay, self.max_crawl_delay)
+
+
+def _cached_connection(base, host_cache):
+    class CachedConnection(base):
+        def _new_conn(self):
+            # Only the address connected to changes; Host, SNI and certificate checks keep the name
+            hostname = self._dns_host
+            try:
+                self._dns_host = host_cache.resolve(hostname, self.port)
+            except socket.gaierror as e:
+                raise NewConnectionError(self, f"Failed to resolve '{hostname}' ({e})")
+            try:
+                return super()._new_conn()
+            finally:
+                self._dns_host = hostname
+
+    CachedConnection.__name__ = "Cached" + base.__name__
+    return CachedConnection
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections resolve host names through a HostCache"""
+
+    def __init__(self, host_cache, **kwargs):
+        # Set first: HTTPAdapter.__init__ builds the pool manager
+        self.host_cache = host_cache
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("CachedHTTPConnectionPool", (HTTPConnectionPool,),
+                         {"ConnectionCls": _cached_connection(HTTPConnection, self.host_cache)}),
+            "https": type("CachedHTTPSConnectionPool", (HTTPSConnectionPool,),
+                          {"ConnectionCls": _cached_connection(HTTPSConnection, self.host_cache)}),
+        }
@@ -0,0 +1,152 @@
+from bs4 import BeautifulSoup
+from collections import namedtuple
+from html.parser import HTMLParser
+import codecs
+import re
+
+# links are raw href values, in document order; resolve them against the page URL
+ParsedPage = namedtuple("ParsedPage", ["title", "text", "links"])
+
+SKIPPED_TAGS = frozenset(["script", "style", "noscript", "template"])
+CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9._:-]+)""", re.IGNORECASE)
+
+
+def charset_from_content_type(content_type):
+    """The charset parameter of a Content-Type header, if it names a known codec"""
+    for param in (content_type or "").split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            value = value.strip().strip("\"'")
+            try:
+                return codecs.lookup(value).name
+            except LookupError:
+                return None
+    return None
+
+
+def decode_body(body, charset=None):
+    """
+    Decode a page using its byte order mark, then the charset of its
+    Content-Type header, then one declared in its first 1KB, falling back
+    to UTF-8
+    """
+    if isinstance(body, str):
+        return body
+    if body.startswith(codecs.BOM_UTF8):
+        return body.decode("utf-8-sig", errors="replace")
+    if charset:
+        try:
+            return body.decode(charset, errors="replace")
+        except LookupError:
+            pass
+    match = CHARSET_RE.search(body[:1024])
+    if match:
+        try:
+            return body.decode(match.group(1).decode("ascii"), errors="replace")
+        except LookupError:
+            pass
+    return body.decode("utf-8", errors="replace")
+
+
+class _StreamExtractor(HTMLParser):
+    """Collects title, visible text and hrefs from parser events; no tree is built"""
+
+    def __init__(self, want_text, want_links):
+        super().__init__(convert_charrefs=True)
+        self.want_text = want_text
+        self.want_links = want_links
+        self.skip_depth = 0
+        self.in_title = False
+        self.title = []
+        self.text = []
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag == "title":
+            self.in_title = True
+        elif tag == "a" and self.want_links:
+            for name, value in attrs:
+                if name == "href" and value:
+                    self.links.append(value)
+                    break
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            if self.skip_depth:
+                self.skip_depth -= 1
+        elif tag == "title":
+            self.in_title = False
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.in_title:
+            self.title.append(data)
+        if self.want_text:
+            self.text.append(data)
+
+
+def _parse_stream(body, want_text, want_links, charset=None):
+    extractor = _StreamExtractor(want_text, want_links)
+    extractor.feed(decode_body(body, charset))
+    extractor.close()
+    return ParsedPage(" ".join(extractor.title), " ".join(extractor.text), extractor.links)
+
+
+def _parse_lxml(body, want_text, want_links, charset=None):
+    try:
+        import lxml.html
+        from lxml import etree
+    except ImportError:
+        raise RuntimeError("The lxml parser backend needs the lxml package (pip install lxml)")
+
+    try:
+        # Without a header charset libxml2 reads <meta charset> itself
+        html_parser = lxml.html.HTMLParser(encoding=charset) if charset and isinstance(body, bytes) else None
+        root = lxml.html.fromstring(body, parser=html_parser)
+    except (etree.ParserError, ValueError):
+        # Empty document, or a str with an encoding declaration
+        return ParsedPage("", "", [])
+
+    etree.strip_elements(root, etree.Comment, *SKIPPED_TAGS, with_tail=False)
+    title = root.findtext(".//title") or ""
+    text = " ".join(root.itertext()) if want_text else ""
+    links = [href for href in root.xpath("//a/@href") if href] if want_links else []
+    return ParsedPage(title, text, links)
+
+
+def _parse_soup(body, want_text, want_links, charset=None):
+    if isinstance(body, bytes):
+        soup = BeautifulSoup(body, "html.parser", from_encoding=charset)
+    else:
+        soup = BeautifulSoup(body, "html.parser")
+    for tag in soup(list(SKIPPED_TAGS)):
+        tag.decompose()
+    title = soup.title.get_text() if soup.title else ""
+    text = soup.get_text(" ") if want_text else ""
+    links = [a["href"] for a in soup.find_all("a", href=True)] if want_links else []
+    return ParsedPage(title, text, links)
+
+
+PARSERS = {
+    "stream": _parse_stream,
+    "lxml": _parse_lxml,
+    "soup": _parse_soup,
+}
+
+
+def parse_html(body, parser="stream", want_text=True, want_links=True, charset=None):
+    """
+    Extract title, visible text and links from a page in one pass.
+    `charset` is the one from the HTTP Content-Type header, if any (see
+    charset_from_content_type).
+
+    Backends: "stream" (stdlib event parser, no tree), "lxml" (C parser,
+    needs lxml) and "soup" (the original BeautifulSoup html.parser path).
+    Script and style contents are never returned as text.
+    """
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown HTML parser: {parser}")
+    return PARSERS[parser](body, want_text, want_links, charset)
@@ -0,0 +1,250 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+import bisect
+import json
+import signal
+import threading
+import time
+
+# Latency buckets in seconds, 0.5 ms to 30 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, values, count) for values, count in self.values.items()]
+
+
+class Gauge(Counter):
+    def set(self, value, *label_values):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram:
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [per-bucket counts (+Inf last), sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe the duration of a block"""
+        if not self.registry.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def quantile(self, q, *label_values):
+        """Estimate a quantile from the buckets (upper bound of the bucket it falls in, "+Inf" past the last)"""
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None or not series[2]:
+                return None
+            target = q * series[2]
+            seen = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[0]):
+                seen += count
+                if seen >= target:
+                    return bound
+        return None
+
+    def samples(self):
+        with self.lock:
+            snapshot = [(values, list(counts), total, count) for values, (counts, total, count) in self.series.items()]
+        samples = []
+        for values, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                samples.append((self.name + "_bucket", values + (str(bound),), cumulative))
+            samples.append((self.name + "_sum", values, total))
+            samples.append((self.name + "_count", values, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and latency histograms shared by the crawler and the
+    indexer. Recording is off by default and can be switched on and off
+    while running (enable()/disable(), SIGUSR1, or the metrics server); when
+    off, every record call returns after one attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(self, name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def toggle(self, *_):
+        self.enabled = not self.enabled
+        print(f"[METRICS]: Recording {'enabled' if self.enabled else 'disabled'}")
+
+    def reset(self):
+        for metric in self.metrics:
+            with metric.lock:
+                if isinstance(metric, Histogram):
+                    metric.series.clear()
+                else:
+                    metric.values.clear()
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            kind = "histogram" if isinstance(metric, Histogram) else "gauge" if isinstance(metric, Gauge) else "counter"
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            names = metric.labels + ("le",) if isinstance(metric, Histogram) else metric.labels
+            for sample_name, values, value in metric.samples():
+                label_text = ",".join(f'{label}="{value}"' for label, value in zip(names, values))
+                lines.append(f"{sample_name}{{{label_text}}} {value}" if label_text else f"{sample_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """Summary of every series: counter and gauge values, histogram count/sum/p50/p99"""
+        data = {"enabled": self.enabled, "timestamp": time.time(), "metrics": {}}
+        for metric in self.metrics:
+            series = []
+            if isinstance(metric, Histogram):
+                with metric.lock:
+                    label_values = [(values, total, count) for values, (_, total, count) in metric.series.items()]
+                for values, total, count in label_values:
+                    series.append({
+                        "labels": dict(zip(metric.labels, values)),
+                        "count": count,
+                        "sum": total,
+                        "p50": metric.quantile(0.5, *values),
+                        "p99": metric.quantile(0.99, *values)
+                    })
+            else:
+                for _, values, value in metric.samples():
+                    series.append({"labels": dict(zip(metric.labels, values)), "value": value})
+            data["metrics"][metric.name] = series
+        return data
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print(f"[METRICS]: Wrote metrics to {path}")
+
+
+REGISTRY = MetricsRegistry()
+
+# Per-stage latency. Stages: fetch_headers (DNS, connect and time to first
+# byte), fetch_body, parse, tokenize, db_write, flush
+STAGE_SECONDS = REGISTRY.histogram("search_engine_stage_seconds", "Time spent in each pipeline stage",
+                                   ("component", "stage"))
+PAGES = REGISTRY.counter("search_engine_pages_total", "Pages handled, by outcome", ("component", "outcome"))
+BYTES_FETCHED = REGISTRY.counter("search_engine_fetched_bytes_total", "Body bytes read", ("component",))
+ROWS_WRITTEN = REGISTRY.counter("search_engine_rows_written_total", "Rows written to MySQL", ("component", "table"))
+QUEUE_DEPTH = REGISTRY.gauge("search_engine_queue_depth", "Items waiting in a queue or buffer", ("component", "queue"))
+HOST_CACHE = REGISTRY.counter("search_engine_host_cache_total", "DNS and robots.txt lookups, by cache and outcome",
+                              ("cache", "outcome"))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    GET /metrics -> Prometheus text, GET /metrics.json -> JSON summary,
+    POST /enable, /disable or /reset to switch recording at runtime
+    """
+
+    def _reply(self, body, content_type):
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._reply(REGISTRY.to_prometheus(), "text/plain; version=0.0.4")
+        elif self.path == "/metrics.json":
+            self._reply(json.dumps(REGISTRY.to_dict()), "application/json")
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        actions = {"/enable": REGISTRY.enable, "/disable": REGISTRY.disable, "/reset": REGISTRY.reset}
+        if self.path not in actions:
+            self.send_error(404)
+            return
+        actions[self.path]()
+        self._reply(json.dumps({"enabled": REGISTRY.enabled}), "application/json")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics(port=None):
+    """
+    Turn recording on, serve the metrics on `port` (if given) from a
+    background thread, and let SIGUSR1 toggle recording
+    """
+    REGISTRY.enable()
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, REGISTRY.toggle)
+
+    if port is None:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[METRICS]: Serving metrics on port {port} (/metrics, /metrics.json)")
+    return server
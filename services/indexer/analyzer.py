@@ -0,0 +1,168 @@
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from services.indexer.segment import encode_varint
+from services.indexer.dedup import simhash
+from services.common.html_parser import parse_html
+from services.common.metrics import STAGE_SECONDS
+import re
+import time
+
+TOKEN_RE = re.compile(r"\w+")
+
+_MISSING = object()
+
+
+def light_stem(word):
+    """English plural stripping (Harman's S-stemmer)"""
+    if word.endswith("ies") and not word.endswith(("eies", "aies")):
+        return word[:-3] + "y"
+    if word.endswith("es") and not word.endswith(("aes", "ees", "oes")):
+        return word[:-1]
+    if word.endswith("s") and not word.endswith(("us", "ss")):
+        return word[:-1]
+    return word
+
+
+STEMMERS = {
+    "none": None,
+    "light": light_stem,
+}
+
+
+def encode_positions(positions):
+    """Delta + varint encode ascending token positions"""
+    out = bytearray()
+    previous = 0
+    for position in positions:
+        encode_varint(position - previous, out)
+        previous = position
+    return bytes(out)
+
+
+class Analyzer:
+    """
+    Turns page fields into postings: every kept term, with its frequency
+    and token positions, per field.
+
+    The decision for each distinct token (too short, stop word, stemmed
+    form) is made once and memoized, so the per-token cost in the hot loop
+    is a single dict lookup after one precompiled regex pass.
+    """
+
+    def __init__(self, stop_words="english", stemmer="none", min_length=3, max_length=255, cache_size=200_000):
+        if stop_words == "english":
+            self.stop_words = frozenset(ENGLISH_STOP_WORDS)
+        elif stop_words in (None, "none"):
+            self.stop_words = frozenset()
+        else:
+            self.stop_words = frozenset(word.lower() for word in stop_words)
+
+        if stemmer not in STEMMERS:
+            raise ValueError(f"Unknown stemmer: {stemmer}")
+        self.stemmer = stemmer
+        self.min_length = min_length
+        self.max_length = max_length  # Longer tokens do not fit the lexicon
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def __getstate__(self):
+        # Don't ship the memo table to worker processes
+        state = self.__dict__.copy()
+        state["cache"] = {}
+        return state
+
+    def normalize(self, token):
+        """Return the index term for a lowercased token, or None if it is dropped"""
+        term = self.cache.get(token, _MISSING)
+        if term is not _MISSING:
+            return term
+
+        if not self.min_length <= len(token) <= self.max_length or token in self.stop_words:
+            term = None
+        else:
+            stem = STEMMERS[self.stemmer]
+            term = stem(token) if stem else token
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[token] = term
+        return term
+
+    def terms(self, text):
+        """Index terms of a piece of text, in order (used for queries)"""
+        return [term for term in map(self.normalize, TOKEN_RE.findall(text.lower())) if term]
+
+    def analyze(self, fields):
+        """
+        Analyze {field: text} into [(term, field, tf, positions), ...].
+        Positions count every token, including dropped ones, so phrase
+        matching sees the real distance between terms.
+        """
+        cache = self.cache
+        normalize = self.normalize
+        postings = []
+
+        for field, text in fields.items():
+            by_term = {}
+            for position, token in enumerate(TOKEN_RE.findall(text.lower())):
+                term = cache.get(token, _MISSING)
+                if term is _MISSING:
+                    term = normalize(token)
+                if term is not None:
+                    positions = by_term.get(term)
+                    if positions is None:
+                        by_term[term] = [position]
+                    else:
+                        positions.append(position)
+
+            postings.extend((term, field, len(positions), positions) for term, positions in by_term.items())
+
+        return postings
+
+
+def analyze_html(body, analyzer, parser="stream", timings=None, charset=None):
+    """
+    Parse a page and analyze its title and body, or None if it has no text.
+    `charset` comes from the page's Content-Type header. Seconds spent
+    parsing and tokenizing are added to `timings` if given.
+    """
+    start = time.perf_counter()
+    page = parse_html(body, parser, want_links=False, charset=charset)
+    parsed = time.perf_counter()
+    if timings is not None:
+        timings["parse"] = parsed - start
+    if not page.text.strip():
+        return None
+
+    postings = analyzer.analyze({"title": page.title, "body": page.text})
+    if timings is not None:
+        timings["tokenize"] = time.perf_counter() - parsed
+    return postings
+
+
+def observe_timings(timings):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, "indexer", stage)
+
+
+# Worker processes get their analyzer and parser once, through the pool initializer
+_worker_analyzer = None
+_worker_parser = "stream"
+
+
+def init_worker(analyzer, parser="stream"):
+    global _worker_analyzer, _worker_parser
+    _worker_analyzer = analyzer
+    _worker_parser = parser
+
+
+def analyze_in_worker(body, charset=None):
+    """
+    Return ((postings, simhash) or None if the page has no text, stage
+    timings). Timings are always taken; the parent records them if metrics
+    are on.
+    """
+    timings = {}
+    postings = analyze_html(body, _worker_analyzer, _worker_parser, timings, charset)
+    if postings is None:
+        return None, timings
+    return (postings, simhash(postings)), timings
@@ -0,0 +1,99 @@
+from functools import lru_cache
+import hashlib
+
+FINGERPRINT_BITS = 64
+
+
+@lru_cache(maxsize=200_000)
+def _term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(postings):
+    """
+    64-bit SimHash of a page from its analyzed postings, each term weighted
+    by its frequency over all fields. Pages that share most of their terms
+    get fingerprints that differ in only a few bits.
+    """
+    weights = {}
+    for term, _, tf, _ in postings:
+        weights[term] = weights.get(term, 0) + tf
+
+    counts = [0] * FINGERPRINT_BITS
+    for term, weight in weights.items():
+        h = _term_hash(term)
+        for bit in range(FINGERPRINT_BITS):
+            if h >> bit & 1:
+                counts[bit] += weight
+            else:
+                counts[bit] -= weight
+
+    fingerprint = 0
+    for bit, count in enumerate(counts):
+        if count > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class SimHashIndex:
+    """
+    Finds fingerprints within `max_distance` bits of a query without
+    comparing against every page.
+
+    Fingerprints are split into max_distance + 1 blocks, with one table per
+    block. Two fingerprints that differ in at most max_distance bits must
+    agree exactly on at least one block (pigeonhole), so only pages sharing
+    a block value with the query are compared bit by bit.
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        size = -(-FINGERPRINT_BITS // blocks)
+        self.blocks = [(start, (1 << min(size, FINGERPRINT_BITS - start)) - 1)
+                       for start in range(0, FINGERPRINT_BITS, size)]
+        self.tables = [{} for _ in self.blocks]
+        self.fingerprints = {}
+
+    def _keys(self, fingerprint):
+        return [fingerprint >> start & mask for start, mask in self.blocks]
+
+    def find(self, fingerprint, exclude=None):
+        """Return the page id of a near duplicate, or None"""
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            for page_id in table.get(key, ()):
+                if page_id == exclude:
+                    continue
+                if (self.fingerprints[page_id] ^ fingerprint).bit_count() <= self.max_distance:
+                    return page_id
+        return None
+
+    def add(self, page_id, fingerprint):
+        self.remove(page_id)
+        self.fingerprints[page_id] = fingerprint
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            table.setdefault(key, set()).add(page_id)
+
+    def remove(self, page_id):
+        fingerprint = self.fingerprints.pop(page_id, None)
+        if fingerprint is None:
+            return
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            pages = table.get(key)
+            if pages:
+                pages.discard(page_id)
+                if not pages:
+                    del table[key]
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+def load_fingerprints(db, index, batch_size=10000):
+    """Fill an index with the fingerprints of already indexed pages"""
+    rows = db.stream_rows("indexing_status", batch_size=batch_size,
+                          where_clause="status = 'indexed' AND simhash IS NOT NULL",
+                          columns="id, page_id, simhash", unbuffered=True)
+    for row in rows:
+        index.add(row['page_id'], row['simhash'])
+    print(f"[DEDUP]: Loaded {len(index)} page fingerprints")
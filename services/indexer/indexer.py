@@ -1,26 +1,55 @@
 from database.db import DatabaseController
-import requests
-from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
-from collections import Counter
-import re
+from storage.page_store import open_page_store
+from services.indexer.pipeline import IndexingPipeline
+from services.indexer.analyzer import Analyzer, encode_positions
+from services.indexer.lexicon import Lexicon, migrate_keyword_postings
+from services.indexer.dedup import SimHashIndex, load_fingerprints
+from database.bulk import BulkLoader
+from services.common.fetch import Fetcher, create_session
+from services.common.host_cache import HostCache
+from services.common.html_parser import charset_from_content_type
+from services.common.metrics import STAGE_SECONDS, PAGES, ROWS_WRITTEN, QUEUE_DEPTH, REGISTRY, start_metrics
+import hashlib
+import os
+import time
 import datetime
 import signal
-from requests.exceptions import TooManyRedirects, RequestException
+
+# Secondary indexes on inverted_index, by name (MySQL names an unnamed index after its first column)
+POSTINGS_INDEXES = {"term_id": "(term_id, page_id)"}
+
 
 class ResumableIndexer:
-    def __init__(self, db, table, timeout=5, insert_buffer_limit=100):
+    def __init__(self, db, table, timeout=5, insert_buffer_limit=1000, page_store=None,
+                 analyzer=None, dedup=None, parser="stream", max_page_bytes=2 * 1024 * 1024, bulk_loader=None,
+                 host_cache=None, fetch_workers=16):
         self.db = db
+        self.analyzer = analyzer or Analyzer()
+        self.parser = parser  # HTML parser backend, see services/common/html_parser.py
+        self.lexicon = Lexicon(db)  # Postings store term ids, assigned in bulk at flush time
+        self.page_store = page_store  # Bodies saved by the crawler; avoids refetching
+        self.dedup = dedup  # SimHashIndex of indexed pages, or None to index near duplicates too
         self.table = table
         self.timeout = timeout
         self.shutdown_requested = False
 
         self.insert_buffer = []
         self.insert_buffer_limit = insert_buffer_limit
+        self.status_buffer = {}
+        # Bulk builds stage postings in a file; those pages' statuses wait for the load
+        self.bulk_loader = bulk_loader
+        self.held_statuses = {}
+        # Set when postings were committed since the index generation was last bumped
+        self.postings_changed = False
+        self.clear_buffer = []
+        self.validator_buffer = {}
 
+        # DNS answers and robots.txt rules, looked up once per host
+        self.host_cache = host_cache or HostCache()
+        self.fetch_workers = fetch_workers  # Threads sharing the session, see IndexingPipeline
         self.session = self._create_session()
+        self.fetcher = Fetcher(self.session, timeout=timeout, max_bytes=max_page_bytes, component="indexer",
+                               host_cache=self.host_cache)
         
         # Set up signal handler for graceful shutdown
         signal.signal(signal.SIGINT, self.signal_handler)
@@ -32,263 +61,401 @@ class ResumableIndexer:
         # Don't exit immediately, let the code finish the current batch
 
     def _create_session(self):
-        session = requests.Session()
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=0.1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
+        # Every fetch thread can hold a connection, to the same host or to a different one each,
+        # so neither a host's pool nor the number of host pools is smaller than the thread count
+        pool_size = max(10, self.fetch_workers)
+        return create_session(pool_connections=pool_size, pool_maxsize=pool_size, host_cache=self.host_cache)
 
-        session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/115.0.0.0 Safari/537.36"
-        })
+    def fetch_page(self, url, validators=None):
+        """
+        Return (body, validators, header charset) for a page. Without
+        validators the body comes from the crawler's store when possible. With
+        validators the request is conditional, and a 304 returns
+        (None, None, None): the page has not changed.
+        """
+        if validators is None and self.page_store:
+            body, charset = self.page_store.get_page(url)
+            if body is not None:
+                return body, None, charset
 
-        return session
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
 
-    def extract_text(self, url):
-        try:
-            response = self.session.get(url, timeout=self.timeout, allow_redirects=True)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
-            return soup.get_text()
-        except TooManyRedirects:
-            print(f"[Redirect Error] Too many redirects for URL: {url}")
-            return ""
-        except RequestException as e:
-            print(f"[Request Error] Failed to fetch {url}: {e}")
-            return ""
-    
-    def extract_keywords(self, text):
-        words = re.findall(r'\b\w+\b', text.lower())
-        words = [word for word in words if word not in ENGLISH_STOP_WORDS and len(word) > 2]
-        return Counter(words).most_common(10)
-
-    def insert_keywords(self, keywords, page_id):
-        for word, freq in keywords:
-            self.insert_buffer.append({
-                "keyword": word,
-                "page_id": page_id,
-                "frequency": freq
-            })
+        response = self.fetcher.get(url, headers=headers)
+        if response.status_code == 304:
+            return None, None, None
+        return response.content, {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }, charset_from_content_type(response.headers.get("Content-Type"))
+
+    def fetch_job(self, row):
+        """
+        Fetch the page for a prepared row and hash its content. Returns the
+        body, or None when the page is unchanged since it was last indexed.
+        """
+        validators = None
+        if row['refresh']:
+            validators = {"etag": row.get('etag'), "last_modified": row.get('last_modified')}
+
+        body, row['validators'], row['charset'] = self.fetch_page(row['url'], validators)
+        if body is None:
+            row['unchanged'] = True
+            return None
+
+        row['content_hash'] = hashlib.sha1(body).hexdigest()
+        row['unchanged'] = row['content_hash'] == row['previous_hash']
+        return None if row['unchanged'] else body
+
+    def record_page(self, row, analyzed):
+        """
+        Sink for one fetched page, given its (postings, simhash). Returns True
+        if its postings were (re)written.
+        """
+        page_id = row['id']
+        url = row['url']
+
+        if row.get('validators'):
+            self.validator_buffer[url] = {"url": url, "content_hash": row['content_hash'], **row['validators']}
+
+        if row['unchanged']:
+            PAGES.inc("indexer", "unchanged")
+            self.queue_index_status(page_id, "indexed")
+            print(f"[UNCHANGED]: {url}")
+            return False
+
+        if analyzed is None:
+            PAGES.inc("indexer", "failed")
+            self.queue_index_status(page_id, "failed", "No text content found")
+            return False
+        postings, fingerprint = analyzed
+
+        # Replace the old postings of a page whose content changed
+        if row['refresh']:
+            self.clear_buffer.append(page_id)
+
+        # Near duplicates of an indexed page are recorded, not indexed
+        if self.dedup is not None:
+            original = self.dedup.find(fingerprint, exclude=page_id)
+            if original is not None:
+                PAGES.inc("indexer", "duplicate")
+                self.dedup.remove(page_id)
+                self.queue_index_status(page_id, "duplicate", content_hash=row['content_hash'],
+                                        fingerprint=fingerprint, duplicate_of=original)
+                print(f"[DUPLICATE]: {url} is a near duplicate of page {original}")
+                return False
+            self.dedup.add(page_id, fingerprint)
+
+        self.insert_keywords(postings, page_id)
+        PAGES.inc("indexer", "indexed")
+        self.queue_index_status(page_id, "indexed", content_hash=row['content_hash'], fingerprint=fingerprint)
+        print(f"[INDEXED]: {len(postings)} terms for URL: {url}")
+        return True
+
+    def insert_keywords(self, postings, page_id):
+        """Buffer a page's postings: every term, per field, with its positions"""
+        for term, field, tf, positions in postings:
+            self.insert_buffer.append((term, page_id, tf, field, encode_positions(positions)))
             
         if len(self.insert_buffer) >= self.insert_buffer_limit:
-            self.db.insert_many("inverted_index", self.insert_buffer)
+            self.flush_postings()
+
+    def flush_postings(self):
+        """Resolve buffered terms to lexicon ids in bulk and write the postings"""
+        # Old postings of changed pages go before their replacements are written
+        if self.clear_buffer:
+            self.clear_existing_index(self.clear_buffer)
+            self.clear_buffer = []
+
+        if not self.insert_buffer:
+            return
+
+        print(f"[SAVING]: {len(self.insert_buffer)} postings")
+        start = time.perf_counter()
+        term_ids = self.lexicon.resolve(term for term, *_ in self.insert_buffer)
+
+        if self.bulk_loader is not None:
+            for term, page_id, tf, field, positions in self.insert_buffer:
+                if term in term_ids:
+                    self.bulk_loader.add((term_ids[term], page_id, tf, field, positions), page_id)
+            STAGE_SECONDS.observe(time.perf_counter() - start, "indexer", "db_write")
             self.insert_buffer = []
+            return
+
+        self.db.insert_many("inverted_index", [
+            {
+                "term_id": term_ids[term],
+                "page_id": page_id,
+                "frequency": tf,
+                "field": field,
+                "positions": positions
+            }
+            for term, page_id, tf, field, positions in self.insert_buffer
+            if term in term_ids
+        ])
+        self.postings_changed = True
+        STAGE_SECONDS.observe(time.perf_counter() - start, "indexer", "db_write")
+        ROWS_WRITTEN.inc("indexer", "inverted_index", amount=len(self.insert_buffer))
+        self.insert_buffer = []
     
-    def update_index_status(self, page_id, status="indexed", error=None):
-        """Update the indexing status of a URL in the database"""
-        try:
-            cursor = self.db.connection.cursor()
-            
-            if error:
-                sql = """UPDATE indexing_status 
-                        SET status = %s, last_indexed = %s, error = %s 
-                        WHERE page_id = %s"""
-                cursor.execute(sql, (
-                    status, 
-                    datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    error[:255],  # Limit error message length
-                    page_id
-                ))
-            else:
-                sql = """UPDATE indexing_status 
-                        SET status = %s, last_indexed = %s 
-                        WHERE page_id = %s"""
-                cursor.execute(sql, (
-                    status, 
-                    datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    page_id
-                ))
-                
-            self.db.connection.commit()
-            cursor.close()
-        except Exception as e:
-            print(f"[DB Error] Failed to update index status: {e}")
-    
-    def get_indexing_status(self, page_id):
-        """Get the current indexing status of a URL"""
+    def queue_index_status(self, page_id, status="indexed", error=None, content_hash=None, fingerprint=None,
+                           duplicate_of=None):
+        """Buffer a status transition; the latest one per page is written on flush"""
+        self.status_buffer[page_id] = {
+            "page_id": page_id,
+            "status": status,
+            "last_indexed": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "error": error[:255] if error else None,  # Limit error message length
+            "content_hash": content_hash,  # Hash of the content now in the index, if it changed
+            "simhash": fingerprint,
+            "duplicate_of": duplicate_of
+        }
+
+    def flush_index_statuses(self, final=False):
+        """Write buffered postings, then every buffered status transition in one statement"""
+        start = time.perf_counter()
+        QUEUE_DEPTH.set(len(self.insert_buffer), "indexer", "postings_buffer")
+        QUEUE_DEPTH.set(len(self.status_buffer), "indexer", "status_buffer")
+
+        # Postings first, so a page is never marked indexed before they exist
+        self.flush_postings()
+
+        if self.bulk_loader is not None:
+            if (final or self.bulk_loader.full()) and self.bulk_loader.load():
+                self.postings_changed = True
+                self.status_buffer = {**self.held_statuses, **self.status_buffer}
+                self.held_statuses = {}
+            # Staged pages stay 'indexing' until their postings are loaded, so
+            # a crash before the load clears and reindexes them
+            for page_id in [page_id for page_id in self.status_buffer if page_id in self.bulk_loader.staged_pages]:
+                self.held_statuses[page_id] = self.status_buffer.pop(page_id)
+
+        if self.status_buffer:
+            if self.db.upsert_many("indexing_status", list(self.status_buffer.values()), updates={
+                "status": "VALUES(status)",
+                "last_indexed": "VALUES(last_indexed)",
+                "error": "VALUES(error)",
+                "content_hash": "COALESCE(VALUES(content_hash), content_hash)",
+                "simhash": "COALESCE(VALUES(simhash), simhash)",
+                "duplicate_of": "VALUES(duplicate_of)"
+            }):
+                self.status_buffer.clear()
+
+        # Validators from refetched pages, for the next conditional request
+        if self.validator_buffer:
+            if self.db.upsert_many(self.table, list(self.validator_buffer.values()), updates={
+                "etag": "VALUES(etag)",
+                "last_modified": "VALUES(last_modified)",
+                "content_hash": "VALUES(content_hash)"
+            }):
+                self.validator_buffer.clear()
+
+        if self.postings_changed:
+            self.bump_generation()
+
+        STAGE_SECONDS.observe(time.perf_counter() - start, "indexer", "flush")
+
+    def bump_generation(self):
+        """Tell query caches that the postings changed"""
         try:
-            cursor = self.db.connection.cursor(dictionary=True)
-            cursor.execute("SELECT status FROM indexing_status WHERE page_id = %s", (page_id,))
-            result = cursor.fetchone()
-            cursor.close()
-            
-            if result:
-                return result['status']
-            return None
+            self.db.execute("INSERT INTO index_generation (id, generation) VALUES (1, 1) "
+                            "ON DUPLICATE KEY UPDATE generation = generation + 1", commit=True,
+                            idempotent=True)  # A double bump only drops caches once more
+            self.postings_changed = False
         except Exception as e:
-            print(f"[DB Error] Failed to get index status: {e}")
-            return None
-    
-    def create_or_update_index_status(self, page_id):
-        """Create or update the indexing status record"""
+            print(f"[DB Error] Failed to bump the index generation: {e}")
+
+    def load_index_statuses(self, page_ids):
+        """Create missing status rows and return {page_id: {status, content_hash}} for a whole batch"""
+        if not page_ids:
+            return {}
+
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.db.upsert_many(
+            "indexing_status",
+            [{"page_id": page_id, "status": "pending", "last_indexed": now} for page_id in page_ids],
+            updates={"page_id": "page_id"}  # Leave existing rows untouched
+        )
+
         try:
-            cursor = self.db.connection.cursor(dictionary=True)
-            
-            # Check if record exists
-            cursor.execute("SELECT id FROM indexing_status WHERE page_id = %s", (page_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                # Create new record
-                sql = """INSERT INTO indexing_status 
-                        (page_id, status, last_indexed) 
-                        VALUES (%s, %s, %s)"""
-                cursor.execute(sql, (
-                    page_id, 
-                    "pending", 
-                    datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                ))
-                self.db.connection.commit()
-            
-            cursor.close()
-            return True
+            placeholders = ", ".join(["%s"] * len(page_ids))
+            rows = self.db.execute(f"SELECT page_id, status, content_hash FROM indexing_status "
+                                   f"WHERE page_id IN ({placeholders})", tuple(page_ids), dictionary=True, fetch=True)
+            return {row['page_id']: row for row in rows}
         except Exception as e:
-            print(f"[DB Error] Failed to create/update index status: {e}")
-            return False
+            print(f"[DB Error] Failed to load index statuses: {e}")
+            return {}
 
-    def clear_existing_index(self, page_id):
-        """Remove existing index entries for a page before reindexing"""
+    def clear_existing_index(self, page_ids):
+        """Remove existing index entries for pages before reindexing"""
+        if not page_ids:
+            return
         try:
-            cursor = self.db.connection.cursor()
-            cursor.execute("DELETE FROM inverted_index WHERE page_id = %s", (page_id,))
-            self.db.connection.commit()
-            cursor.close()
+            placeholders = ", ".join(["%s"] * len(page_ids))
+            self.db.execute(f"DELETE FROM inverted_index WHERE page_id IN ({placeholders})", tuple(page_ids),
+                            commit=True, idempotent=True)
+            self.postings_changed = True
         except Exception as e:
             print(f"[DB Error] Failed to clear existing index: {e}")
 
-    def index_urls(self, reindex=False):
+    def prepare_batch(self, batch, reindex=False):
         """
-        Index URLs from the database table
-        
-        Args:
-            reindex (bool): If True, reindex already indexed pages
+        Decide which rows of a batch need indexing, using one status query and
+        one bulk write for the whole batch. Returns the rows to index.
+
+        Already indexed pages are only refreshed when reindexing: they are
+        refetched conditionally, and their postings are rewritten only if
+        the content hash changed.
         """
-        offset = 0
-        total_indexed = 0
-        start_time = datetime.datetime.now()
-        
-        try:
-            while not self.shutdown_requested:
-                print(f"[BATCH]: Fetching batch from offset {offset}")
-                batch = self.db.fetch_batch(self.table, batch_size=100, offset=offset, where_clause="status = 'processed'")
-                
-                if not batch:
-                    print("[INFO] No more URLs to index. Process complete.")
-                    break
-
-                for row in batch:
-                    if self.shutdown_requested:
-                        break
-                        
-                    page_id = row['id']
-                    url = row['url']
-                    
-                    # Ensure we have a status record for this page
-                    self.create_or_update_index_status(page_id)
-                    
-                    # Check if URL has already been indexed
-                    status = self.get_indexing_status(page_id)
-                    
-                    # Skip if already indexed and not reindexing
-                    if status == "indexed" and not reindex:
-                        print(f"[SKIPPED]: Already indexed URL: {url}")
-                        continue
-                    
-                    # Update status to "indexing"
-                    self.update_index_status(page_id, "indexing")
-                    
-                    try:
-                        # Clear existing index if reindexing
-                        if status == "indexed" and reindex:
-                            self.clear_existing_index(page_id)
-                        
-                        # Extract text and keywords
-                        print(f"[INDEXING]: {url}")
-                        text = self.extract_text(url)
-                        
-                        if not text.strip():
-                            self.update_index_status(page_id, "failed", "No text content found")
-                            continue
-                        
-                        keywords = self.extract_keywords(text)
-                        self.insert_keywords(keywords, page_id)
-                        self.update_index_status(page_id, "indexed")
-                        
-                        total_indexed += 1
-                        print(f"[INDEXED]: {len(keywords)} keywords for URL: {url}")
-                        
-                    except Exception as e:
-                        error_msg = f"Failed to index: {str(e)}"
-                        print(f"[ERROR]: {error_msg} for URL: {url}")
-                        self.update_index_status(page_id, "failed", error_msg)
-
-                offset += len(batch)
-                
-                # Save progress periodically
-                if self.insert_buffer:
-                    print(f"[SAVING]: {len(self.insert_buffer)} keyword entries")
-                    self.db.insert_many("inverted_index", self.insert_buffer)
-                    self.insert_buffer = []
-        
-        except KeyboardInterrupt:
-            print("\n[INFO] Indexing interrupted by user.")
-        
-        finally:
-            # Save any remaining data
-            if self.insert_buffer:
-                print(f"[SAVING]: Final batch of {len(self.insert_buffer)} keyword entries")
-                self.db.insert_many("inverted_index", self.insert_buffer)
-                self.insert_buffer = []
-            
-            elapsed = (datetime.datetime.now() - start_time).total_seconds()
-            print(f"\n[SUMMARY] Indexed {total_indexed} URLs in {elapsed:.2f} seconds")
-            print(f"[SUMMARY] Average: {total_indexed/elapsed:.2f} URLs/sec")
-            
-            if self.shutdown_requested:
-                print("[INFO] Indexing paused. Run again to continue.")
-            else:
-                print("[INFO] Indexing completed successfully.")
+        statuses = self.load_index_statuses([row['id'] for row in batch])
 
+        to_index = []
+        to_clear = []
+        for row in batch:
+            info = statuses.get(row['id'], {})
+            status = info.get('status')
 
-def run_indexer(host, user, password, database):
-    print("[INFO] Starting indexer...")
-    db = DatabaseController(
-        host=host,
-        user=user,
-        password=password,
-        database=database
-    )
+            # Skip if already indexed (or found to be a duplicate) and not reindexing
+            if status in ("indexed", "duplicate") and not reindex:
+                print(f"[SKIPPED]: Already indexed URL: {row['url']}")
+                continue
+
+            row['refresh'] = status == "indexed"
+            row['previous_hash'] = info.get('content_hash') if row['refresh'] else None
 
+            # Drop postings left over from an interrupted run
+            if status == "indexing":
+                to_clear.append(row['id'])
+
+            self.queue_index_status(row['id'], "indexing")
+            to_index.append(row)
+
+        self.flush_index_statuses()
+        self.clear_existing_index(to_clear)
+        return to_index
+
+
+def create_index_tables(db):
+    """Create (or migrate) indexing_status, lexicon and inverted_index"""
     # Create index status tracking table
     db.create_table("indexing_status", {
         "id": "INT AUTO_INCREMENT PRIMARY KEY",
         "page_id": "INT NOT NULL UNIQUE",
-        "status": "ENUM('pending', 'indexing', 'indexed', 'failed') DEFAULT 'pending'",
+        "status": "ENUM('pending', 'indexing', 'indexed', 'failed', 'duplicate') DEFAULT 'pending'",
         "last_indexed": "DATETIME DEFAULT CURRENT_TIMESTAMP",
         "error": "VARCHAR(255) DEFAULT NULL",
+        "content_hash": "CHAR(40) DEFAULT NULL",
+        "simhash": "BIGINT UNSIGNED DEFAULT NULL",
+        "duplicate_of": "INT DEFAULT NULL",
         "FOREIGN KEY (page_id) REFERENCES crawler_queue(id) ON DELETE CASCADE": ""
     })
+    db.modify_column("indexing_status", "status",
+                     "ENUM('pending', 'indexing', 'indexed', 'failed', 'duplicate') DEFAULT 'pending'")
+    db.add_missing_columns("indexing_status", {
+        "content_hash": "CHAR(40) DEFAULT NULL",
+        "simhash": "BIGINT UNSIGNED DEFAULT NULL",
+        "duplicate_of": "INT DEFAULT NULL"
+    })
+
+    # Validators and content hash of the last fetch, shared with the crawler
+    db.add_missing_columns("crawler_queue", {
+        "etag": "VARCHAR(255) DEFAULT NULL",
+        "last_modified": "VARCHAR(64) DEFAULT NULL",
+        "content_hash": "CHAR(40) DEFAULT NULL"
+    })
+
+    # Create the term lexicon: each distinct term is stored once and postings refer to its id
+    db.create_table("lexicon", {
+        "id": "INT AUTO_INCREMENT PRIMARY KEY",
+        "term": "VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL UNIQUE"
+    })
 
     # Create inverted index table if not exists
     db.create_table("inverted_index", {
         "id": "INT AUTO_INCREMENT PRIMARY KEY",
-        "keyword": "VARCHAR(255) NOT NULL",
+        "term_id": "INT NOT NULL",
         "page_id": "INT NOT NULL",
         "frequency": "INT NOT NULL DEFAULT 1",
+        "field": "ENUM('title', 'body') NOT NULL DEFAULT 'body'",
+        "positions": "MEDIUMBLOB",
         "FOREIGN KEY (page_id) REFERENCES crawler_queue(id) ON DELETE CASCADE": "",
-        "INDEX (keyword)": ""
+        "INDEX (term_id, page_id)": ""
+    })
+    migrate_keyword_postings(db)
+    db.add_missing_columns("inverted_index", {
+        "field": "ENUM('title', 'body') NOT NULL DEFAULT 'body'",
+        "positions": "MEDIUMBLOB"
+    })
+
+    # Bumped whenever postings are committed; query caches compare against it
+    db.create_table("index_generation", {
+        "id": "TINYINT PRIMARY KEY",
+        "generation": "BIGINT NOT NULL DEFAULT 0"
     })
 
+    # Static page scores written by the PageRank job (services/indexer/pagerank.py)
+    db.create_table("page_rank", {
+        "page_id": "INT PRIMARY KEY",
+        "score": "FLOAT NOT NULL"
+    })
+
+
+def run_indexer(host, user, password, database, page_store_dir="data/page_store", fetch_workers=16, parse_workers=None,
+                reindex=False, duplicate_distance=3, parser="stream", bulk_load=False, staging_dir="data/bulk",
+                metrics_port=None, metrics_dump=None):
+    print("[INFO] Starting indexer...")
+    if metrics_port is not None or metrics_dump:
+        start_metrics(metrics_port)
+
+    db = DatabaseController(
+        host=host,
+        user=user,
+        password=password,
+        database=database,
+        allow_local_infile=bulk_load
+    )
+
+    create_index_tables(db)
+
+    # Bulk builds drop the term index and rebuild it once at the end; a normal
+    # run also restores it after an interrupted bulk build
+    bulk_loader = None
+    if bulk_load:
+        db.drop_indexes("inverted_index", POSTINGS_INDEXES)
+        bulk_loader = BulkLoader(db, "inverted_index", ["term_id", "page_id", "frequency", "field", "positions"],
+                                 os.path.join(staging_dir, "inverted_index.tsv"))
+    else:
+        db.add_missing_indexes("inverted_index", POSTINGS_INDEXES)
+
     # Create the indexer
-    indexer = ResumableIndexer(db, "crawler_queue")
+    page_store = open_page_store(page_store_dir)
+
+    # Pages within duplicate_distance bits of an indexed page's SimHash are skipped
+    dedup = None
+    if duplicate_distance is not None:
+        dedup = SimHashIndex(max_distance=duplicate_distance)
+        load_fingerprints(db, dedup)
+
+    indexer = ResumableIndexer(db, "crawler_queue", page_store=page_store, dedup=dedup,
+                               parser=parser, bulk_loader=bulk_loader, fetch_workers=fetch_workers)
     
-    # Start indexing (set reindex=True to force reindex already indexed pages)
-    indexer.index_urls(reindex=False)
+    # Fetch, parse and store pages in parallel stages
+    pipeline = IndexingPipeline(indexer, parse_workers=parse_workers)
+
+    # Start indexing (reindex=True refreshes already indexed pages that changed)
+    pipeline.run(reindex=reindex)
+
+    if bulk_loader is not None:
+        bulk_loader.close()
+        print("[BULK]: Rebuilding the term index")
+        db.add_missing_indexes("inverted_index", POSTINGS_INDEXES)
     
-    db.close()
\ No newline at end of file
+    page_store.close()
+    db.close()
+
+    if metrics_dump:
+        REGISTRY.dump(metrics_dump)
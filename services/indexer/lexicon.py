@@ -0,0 +1,80 @@
+class Lexicon:
+    """
+    Maps terms to compact integer ids stored in the `lexicon` table.
+
+    Ids are resolved in bulk: unknown terms are inserted with one multi-row
+    statement and read back with one IN query, and every id is cached in
+    process, so the steady state costs no round trips at all.
+    """
+
+    def __init__(self, db, cache_size=2_000_000, chunk_size=1000):
+        self.db = db
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self.ids = {}
+
+    def _select(self, terms):
+        try:
+            placeholders = ", ".join(["%s"] * len(terms))
+            rows = self.db.execute(f"SELECT id, term FROM lexicon WHERE term IN ({placeholders})", tuple(terms),
+                                   dictionary=True, fetch=True)
+            return {row['term']: row['id'] for row in rows}
+        except Exception as e:
+            print(f"[DB Error] Failed to look up term ids: {e}")
+            return {}
+
+    def resolve(self, terms, create=True):
+        """Return {term: id} for the given terms, assigning ids to new terms if `create`"""
+        resolved = {}
+        missing = []
+        for term in set(terms):
+            term_id = self.ids.get(term)
+            if term_id is None:
+                missing.append(term)
+            else:
+                resolved[term] = term_id
+
+        if len(self.ids) + len(missing) > self.cache_size:
+            self.ids.clear()
+
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start:start + self.chunk_size]
+            if create:
+                # Existing terms are left alone; only new ones get an id
+                self.db.upsert_many("lexicon", [{"term": term} for term in chunk], updates={"term": "term"})
+            found = self._select(chunk)
+            self.ids.update(found)
+            resolved.update(found)
+
+        return resolved
+
+    def terms_by_id(self, batch_size=10000):
+        """Load the whole lexicon as {id: term}"""
+        return {row['id']: row['term']
+                for row in self.db.stream_rows("lexicon", batch_size=batch_size, columns="id, term")}
+
+
+def migrate_keyword_postings(db):
+    """
+    Convert an inverted_index table from the old layout (one VARCHAR keyword
+    per posting) to term ids, filling the lexicon from the existing keywords.
+    """
+    if "keyword" not in db.get_columns("inverted_index"):
+        return
+
+    print("[DATABASE]: Migrating inverted_index keywords to lexicon term ids")
+    try:
+        cursor = db.connection.cursor()
+        cursor.execute("INSERT IGNORE INTO lexicon (term) "
+                       "SELECT DISTINCT keyword COLLATE utf8mb4_bin FROM inverted_index")
+        if "term_id" not in db.get_columns("inverted_index"):
+            cursor.execute("ALTER TABLE inverted_index ADD COLUMN term_id INT NOT NULL DEFAULT 0")
+        cursor.execute("UPDATE inverted_index ii JOIN lexicon l ON l.term = ii.keyword COLLATE utf8mb4_bin "
+                       "SET ii.term_id = l.id")
+        cursor.execute("ALTER TABLE inverted_index DROP INDEX keyword, DROP COLUMN keyword, "
+                       "ADD INDEX (term_id, page_id)")
+        db.connection.commit()
+        cursor.close()
+        print("[DATABASE]: Migration complete")
+    except Exception as e:
+        print(f"[DATABASE]: Error while migrating inverted_index: {e}")
@@ -0,0 +1,190 @@
+from database.db import DatabaseController
+from database.bulk import BulkLoader
+from services.spider.frontier import url_fingerprint
+from services.spider.link_graph import EDGE_FILE
+from array import array
+import glob
+import os
+import time
+
+# Edges are mapped to page indexes this many at a time, so memory stays
+# bounded by the deduplicated graph rather than the raw edge logs
+EDGE_CHUNK = 16_000_000
+
+
+def _require_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("The PageRank job needs numpy (pip install numpy scipy)")
+    return numpy
+
+
+def edge_files(path):
+    """Edge logs of an unsharded crawl and of every shard of a sharded one"""
+    return sorted(glob.glob(os.path.join(path, EDGE_FILE)) + glob.glob(os.path.join(path, "shard-*", EDGE_FILE)))
+
+
+def load_pages(db, np):
+    """Return (sorted URL fingerprints, page ids in the same order) for every crawler_queue row"""
+    fingerprints = array("Q")
+    page_ids = array("q")
+    for row in db.stream_rows("crawler_queue", batch_size=100000, columns="id, url", unbuffered=True):
+        fingerprints.append(url_fingerprint(row['url']))
+        page_ids.append(row['id'])
+
+    fingerprints = np.frombuffer(fingerprints, dtype=np.uint64)
+    page_ids = np.frombuffer(page_ids, dtype=np.int64)
+    order = np.argsort(fingerprints, kind="stable")
+    return fingerprints[order], page_ids[order]
+
+
+def load_edges(paths, fingerprints, np):
+    """
+    Map logged (source, target) fingerprint pairs to page indexes, dropping
+    edges to pages that are not in crawler_queue, and return the distinct
+    edges as one sorted int64 array of source * n + target
+    """
+    n = len(fingerprints)
+    parts = []
+    for path in paths:
+        edges = np.memmap(path, dtype=np.uint64, mode="r")
+        edges = edges[:len(edges) - len(edges) % 2].reshape(-1, 2)
+        for start in range(0, len(edges), EDGE_CHUNK):
+            chunk = np.asarray(edges[start:start + EDGE_CHUNK])
+            source = np.searchsorted(fingerprints, chunk[:, 0])
+            target = np.searchsorted(fingerprints, chunk[:, 1])
+            source[source == n] = 0
+            target[target == n] = 0
+            known = (fingerprints[source] == chunk[:, 0]) & (fingerprints[target] == chunk[:, 1]) & (source != target)
+            # Deduplicate every chunk right away; recrawls log the same edges again
+            parts.append(np.unique(source[known].astype(np.int64) * n + target[known]))
+        del edges
+
+    if not parts:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(parts))
+
+
+def pagerank(edges, n, np, damping=0.85, tolerance=1e-6, max_iterations=100):
+    """
+    Power iteration over the link matrix in CSR form (rows are sources,
+    which `edges` is already sorted by). Pages without outbound links
+    spread their rank evenly over every page.
+    """
+    source = (edges // n).astype(np.int32)
+    target = (edges % n).astype(np.int32)
+    out_degree = np.bincount(source, minlength=n).astype(np.float64)
+    dangling = out_degree == 0
+    # Each edge carries 1 / out-degree of its source
+    weights = (1.0 / out_degree[source]).astype(np.float32)
+
+    try:
+        from scipy.sparse import csr_matrix
+        indptr = np.concatenate(([0], np.cumsum(out_degree, dtype=np.int64)))
+        transposed = csr_matrix((weights, target, indptr), shape=(n, n)).T.tocsr()
+        spread = transposed.dot
+        del source
+    except ImportError:
+        # numpy only: scatter-add along the edges each iteration
+        def spread(rank):
+            return np.bincount(target, weights=weights * rank[source], minlength=n)
+
+    rank = np.full(n, 1.0 / n)
+    for iteration in range(1, max_iterations + 1):
+        start = time.time()
+        leaked = rank[dangling].sum()
+        updated = damping * (spread(rank) + leaked / n) + (1 - damping) / n
+        delta = np.abs(updated - rank).sum()
+        rank = updated
+        print(f"[PAGERANK]: Iteration {iteration}: L1 change {delta:.2e} ({time.time() - start:.2f} seconds)")
+        if delta < tolerance:
+            break
+    return rank
+
+
+def normalize_scores(rank, np):
+    """Map PageRank to 0..1 on a log scale: 0 for a page nobody links to, 1 for the top page"""
+    scaled = np.log1p(rank * len(rank))
+    baseline = scaled.min()
+    spread = scaled.max() - baseline
+    if spread <= 0:
+        return np.zeros(len(rank))
+    return (scaled - baseline) / spread
+
+
+def load_static_scores(db):
+    """page_rank scores as an array('f') indexed by page id (0 for pages without one)"""
+    scores = array("f")
+    try:
+        for row in db.stream_rows("page_rank", batch_size=100000, columns="page_id, score", key="page_id",
+                                  unbuffered=True):
+            page_id = row['page_id']
+            if page_id >= len(scores):
+                scores.extend([0.0] * (page_id + 1 - len(scores)))
+            scores[page_id] = row['score']
+    except Exception as e:
+        print(f"[PAGERANK]: Could not load page scores: {e}")
+    return scores
+
+
+def run_pagerank(host, user, password, database, link_graph_dir="data/link_graph", damping=0.85,
+                 tolerance=1e-6, max_iterations=100, staging_dir="data/bulk"):
+    np = _require_numpy()
+    print("[INFO] Computing PageRank...")
+    db = DatabaseController(
+        host=host,
+        user=user,
+        password=password,
+        database=database,
+        allow_local_infile=True
+    )
+
+    paths = edge_files(link_graph_dir)
+    if not paths:
+        print(f"[PAGERANK]: No edge logs under {link_graph_dir}; run the crawler first")
+        db.close()
+        return
+
+    start = time.time()
+    fingerprints, page_ids = load_pages(db, np)
+    n = len(fingerprints)
+    edges = load_edges(paths, fingerprints, np)
+    print(f"[PAGERANK]: {len(edges)} distinct links between {n} pages ({time.time() - start:.2f} seconds)")
+    if not n:
+        db.close()
+        return
+
+    scores = normalize_scores(pagerank(edges, n, np, damping, tolerance, max_iterations), np)
+    del edges
+
+    # Build the new table on the side and swap it in, so rankers never see it half written
+    db.execute("DROP TABLE IF EXISTS page_rank_new")
+    db.create_table("page_rank_new", {
+        "page_id": "INT PRIMARY KEY",
+        "score": "FLOAT NOT NULL"
+    })
+    loader = BulkLoader(db, "page_rank_new", ["page_id", "score"], os.path.join(staging_dir, "page_rank.tsv"))
+    loaded = True
+    for page_id, score in zip(page_ids.tolist(), scores.tolist()):
+        loader.add((page_id, "%.6g" % score))
+        if loader.full() and not loader.load():
+            loaded = False
+            break
+    loaded = loaded and loader.load()
+    loader.close()
+
+    if loaded:
+        db.create_table("page_rank", {
+            "page_id": "INT PRIMARY KEY",
+            "score": "FLOAT NOT NULL"
+        })
+        # Left over if an earlier run stopped between the rename and the drop
+        db.execute("DROP TABLE IF EXISTS page_rank_old")
+        db.execute("RENAME TABLE page_rank TO page_rank_old, page_rank_new TO page_rank")
+        db.execute("DROP TABLE page_rank_old")
+        print(f"[PAGERANK]: Scored {n} pages in {time.time() - start:.2f} seconds")
+    else:
+        print("[PAGERANK]: Scores could not be written; page_rank is unchanged")
+
+    db.close()
@@ -0,0 +1,171 @@
+from services.indexer.analyzer import init_worker, analyze_in_worker, observe_timings
+from services.common.metrics import PAGES, QUEUE_DEPTH
+import concurrent.futures
+import datetime
+import itertools
+import os
+import queue
+import threading
+
+
+class IndexingPipeline:
+    """
+    The indexing loop, run as stages over a ResumableIndexer:
+
+        DB source -> fetch threads -> parse/tokenize processes -> DB sink
+
+    All database work (status checks, keyword inserts, status updates) stays
+    on the calling thread, which acts as both source and sink, and is done a
+    batch at a time. At most
+    `max_in_flight` pages are between the two at any time, which bounds the
+    queues between stages. Pages are marked 'indexing' before they are
+    fetched, so an interrupted run resumes where it stopped.
+    """
+
+    _STOP = object()
+
+    def __init__(self, indexer, fetch_workers=None, parse_workers=None, max_in_flight=256, batch_size=100):
+        self.indexer = indexer
+        # Defaults to the thread count the indexer's HTTP connection pools were sized for
+        self.fetch_workers = fetch_workers or indexer.fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count()
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+
+        self.fetch_queue = queue.Queue()
+        self.results = queue.Queue()
+
+    def _rows(self):
+        """Yield processed crawler rows in id order"""
+        yield from self.indexer.db.stream_rows(self.indexer.table, batch_size=self.batch_size,
+                                               where_clause="status = 'processed'",
+                                               columns="id, url, etag, last_modified")
+
+    def _fetch_worker(self, parse_pool):
+        while True:
+            item = self.fetch_queue.get()
+            if item is self._STOP:
+                return
+
+            row = item
+            try:
+                body = self.indexer.fetch_job(row)
+            except Exception as e:
+                self.results.put((row, None, e))
+                continue
+
+            # Unchanged pages skip parsing entirely
+            if body is None:
+                self.results.put((row, None, None))
+                continue
+
+            try:
+                future = parse_pool.submit(analyze_in_worker, body, row.get('charset'))
+            except RuntimeError as e:
+                # Pool already shut down
+                self.results.put((row, None, e))
+                continue
+            future.add_done_callback(lambda f, row=row: self.results.put((row, f, None)))
+
+    def _dispatch(self, batch, reindex):
+        """Source stage: hand the rows of a batch that need indexing to the fetchers"""
+        to_index = self.indexer.prepare_batch(batch, reindex)
+        for row in to_index:
+            self.fetch_queue.put(row)
+        return len(to_index)
+
+    def _store(self, row, future, error):
+        """Sink stage: write postings and the final status for one page"""
+        try:
+            if error is not None:
+                raise error
+
+            analyzed = None
+            if future is not None:
+                analyzed, timings = future.result()
+                observe_timings(timings)
+            return self.indexer.record_page(row, analyzed)
+
+        except Exception as e:
+            error_msg = f"Failed to index: {str(e)}"
+            print(f"[ERROR]: {error_msg} for URL: {row['url']}")
+            PAGES.inc("indexer", "failed")
+            self.indexer.queue_index_status(row['id'], "failed", error_msg)
+            return False
+
+    def run(self, reindex=False):
+        indexer = self.indexer
+        total_indexed = 0
+        in_flight = 0
+        start_time = datetime.datetime.now()
+
+        # Each parse process receives the indexer's analyzer and parser once, at startup
+        parse_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.parse_workers,
+            initializer=init_worker,
+            initargs=(indexer.analyzer, indexer.parser)
+        )
+        fetchers = [
+            threading.Thread(target=self._fetch_worker, args=(parse_pool,), daemon=True)
+            for _ in range(self.fetch_workers)
+        ]
+        for thread in fetchers:
+            thread.start()
+
+        rows = self._rows()
+        exhausted = False
+        read_failed = False
+
+        try:
+            while True:
+                # Feed the fetchers a batch at a time until the in-flight window is full
+                while not exhausted and in_flight < self.max_in_flight and not indexer.shutdown_requested:
+                    try:
+                        batch = list(itertools.islice(rows, self.batch_size))
+                    except Exception as e:
+                        # Finish the pages already in flight, but do not report the table as done
+                        print(f"[ERROR]: Reading URLs to index failed: {e}")
+                        exhausted = read_failed = True
+                        break
+                    if not batch:
+                        exhausted = True
+                        print("[INFO] No more URLs to index. Process complete.")
+                        break
+                    in_flight += self._dispatch(batch, reindex)
+
+                if in_flight == 0:
+                    break
+
+                # Drain one finished page; pages already in flight are completed on shutdown
+                if self._store(*self.results.get()):
+                    total_indexed += 1
+                in_flight -= 1
+
+                QUEUE_DEPTH.set(in_flight, "indexer", "in_flight")
+                QUEUE_DEPTH.set(self.fetch_queue.qsize(), "indexer", "fetch_queue")
+
+                # Write statuses in bulk rather than per page
+                if len(indexer.status_buffer) >= self.batch_size:
+                    indexer.flush_index_statuses()
+
+        except KeyboardInterrupt:
+            print("\n[INFO] Indexing interrupted by user.")
+
+        finally:
+            for _ in fetchers:
+                self.fetch_queue.put(self._STOP)
+            parse_pool.shutdown(wait=False, cancel_futures=True)
+
+            # Save any remaining data
+            indexer.flush_index_statuses(final=True)
+
+            elapsed = (datetime.datetime.now() - start_time).total_seconds()
+            print(f"\n[SUMMARY] Indexed {total_indexed} URLs in {elapsed:.2f} seconds")
+            print(f"[SUMMARY] Average: {total_indexed/elapsed:.2f} URLs/sec")
+
+            if read_failed:
+                print("[INFO] Indexing stopped by a database error. Run again to continue.")
+            elif indexer.shutdown_requested:
+                print("[INFO] Indexing paused. Run again to continue.")
+            else:
+                print("[INFO] Indexing completed successfully.")
@@ -0,0 +1,336 @@
+from database.db import DatabaseController
+from services.indexer.segment import SegmentReader, decode_postings
+from services.common.cache import LRUCache
+from services.indexer.analyzer import Analyzer
+from services.indexer.pagerank import load_static_scores
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import bisect
+import heapq
+import json
+import math
+import os
+import threading
+import time
+
+
+class PostingCursor:
+    """Iterates one term's postings in page_id order, with skipping"""
+
+    def __init__(self, page_ids, tfs, idf, upper_bound):
+        # Shared with the postings cache; cursors only read them
+        self.page_ids = page_ids
+        self.tfs = tfs
+        self.idf = idf
+        self.upper_bound = upper_bound
+        self.position = 0
+
+    def current(self):
+        if self.position < len(self.page_ids):
+            return self.page_ids[self.position]
+        return None
+
+    def advance_to(self, page_id):
+        """Move to the first posting >= page_id"""
+        self.position = bisect.bisect_left(self.page_ids, page_id, self.position)
+        return self.current()
+
+    def tf(self):
+        return self.tfs[self.position]
+
+
+class QueryEngine:
+    """
+    BM25 top-k retrieval over an index segment.
+
+    Uses MaxScore dynamic pruning: query terms are ordered by their score
+    upper bound, and once the k-th best score exceeds the combined bound of
+    the weakest terms, documents that only contain those terms are never
+    scored. The reported total is an estimate, so no query scores every
+    matching page just to count them.
+
+    An optional static score per page (PageRank) is added to BM25; its
+    maximum counts toward every bound, so pruning stays exact.
+
+    Decoded postings of hot terms are kept in an LRU bounded by the number
+    of postings, and each normalized query's top `result_depth` pages in an
+    LRU/TTL result cache, so repeated queries and later result pages are
+    sliced from memory. Both belong to this engine's segment: a new
+    segment gets a new engine (see SearchServer.current_engine).
+    """
+
+    def __init__(self, segment, analyzer=None, k1=1.2, b=0.75, static_scores=None, static_weight=1.0,
+                 result_cache_size=10000, result_ttl=300.0, result_depth=100, postings_cache_size=5_000_000):
+        self.segment = segment
+        # Must match the indexer's analyzer so query terms stem the same way
+        self.analyzer = analyzer or Analyzer()
+        self.k1 = k1
+        self.b = b
+        # Query-independent score per page id in 0..1 (PageRank), added with static_weight
+        self.static_scores = static_scores
+        self.static_weight = static_weight
+        self.static_bound = static_weight * max(static_scores) if static_scores else 0.0
+
+        self.result_depth = result_depth
+        self.result_cache = LRUCache(result_cache_size, ttl=result_ttl)
+        # () marks a term that is not in the segment
+        self.postings_cache = LRUCache(postings_cache_size, weigh=lambda entry: 1 + (len(entry[1]) if entry else 0))
+
+    def with_segment(self, segment, static_scores=None):
+        """A fresh engine (and caches) with these settings over another segment"""
+        return QueryEngine(segment, self.analyzer, self.k1, self.b, static_scores, self.static_weight,
+                           self.result_cache.max_size, self.result_cache.ttl, self.result_depth,
+                           self.postings_cache.max_size)
+
+    def parse_query(self, raw):
+        return self.analyzer.terms(raw)
+
+    def idf(self, df):
+        n = self.segment.num_docs
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def term_score(self, idf, tf, doc_length):
+        norm = self.k1 * (1 - self.b + self.b * doc_length / (self.segment.avg_doc_length or 1))
+        return idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def static_score(self, page_id):
+        scores = self.static_scores
+        if not scores or page_id >= len(scores):
+            return 0.0
+        return self.static_weight * scores[page_id]
+
+    def term_postings(self, term):
+        """Return (TermInfo, page ids, tfs) for a term, or None if it is not indexed"""
+        entry = self.postings_cache.get(term)
+        if entry is None:
+            info = self.segment.lookup(term)
+            entry = ()
+            if info is not None:
+                postings = decode_postings(self.segment.map[info.offset:info.offset + info.length])
+                entry = (info, [page_id for page_id, _ in postings], [tf for _, tf in postings])
+            self.postings_cache.put(term, entry)
+        return entry or None
+
+    def _cursors(self, terms):
+        cursors = []
+        for term in dict.fromkeys(terms):
+            entry = self.term_postings(term)
+            if entry is None:
+                continue
+            info, page_ids, tfs = entry
+            idf = self.idf(info.df)
+            # Best case for this term: its highest tf in the shortest possible document
+            upper_bound = idf * info.max_tf * (self.k1 + 1) / (info.max_tf + self.k1 * (1 - self.b))
+            cursors.append(PostingCursor(page_ids, tfs, idf, upper_bound))
+        return cursors
+
+    def estimate_total(self, terms):
+        """Estimated number of pages matching any term, assuming terms occur independently"""
+        n = self.segment.num_docs
+        if not n:
+            return 0
+        miss = 1.0
+        largest = 0
+        for term in dict.fromkeys(terms):
+            entry = self.term_postings(term)
+            df = entry[0].df if entry else 0
+            miss *= 1 - df / n
+            largest = max(largest, df)
+        return max(largest, round(n * (1 - miss)))
+
+    def top_k(self, terms, k=10):
+        """Return [(page_id, score), ...] for the k best pages, best first"""
+        cursors = sorted(self._cursors(terms), key=lambda c: c.upper_bound)
+        if not cursors or k <= 0:
+            return []
+
+        # prefix_bounds[i] is the best score achievable from cursors[:i] alone
+        prefix_bounds = [0.0]
+        for cursor in cursors:
+            prefix_bounds.append(prefix_bounds[-1] + cursor.upper_bound)
+
+        heap = []
+        threshold = 0.0
+        first_essential = 0
+
+        while True:
+            essential = cursors[first_essential:]
+            candidates = [c.current() for c in essential if c.current() is not None]
+            if not candidates:
+                break
+            page_id = min(candidates)
+
+            doc_length = self.segment.doc_length(page_id)
+            score = self.static_score(page_id)
+            for cursor in essential:
+                if cursor.current() == page_id:
+                    score += self.term_score(cursor.idf, cursor.tf(), doc_length)
+                    cursor.position += 1
+
+            # Non-essential terms, strongest first, only while they can still matter
+            for i in range(first_essential - 1, -1, -1):
+                if score + prefix_bounds[i + 1] <= threshold:
+                    break
+                cursor = cursors[i]
+                if cursor.advance_to(page_id) == page_id:
+                    score += self.term_score(cursor.idf, cursor.tf(), doc_length)
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -page_id))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -page_id))
+
+            if len(heap) == k:
+                threshold = heap[0][0]
+                # Terms whose combined bound (plus the best static score) cannot beat
+                # the threshold stop driving candidates
+                while (first_essential < len(cursors)
+                       and prefix_bounds[first_essential + 1] + self.static_bound <= threshold):
+                    first_essential += 1
+
+        return [(-neg_page_id, score) for score, neg_page_id in sorted(heap, reverse=True)]
+
+    def search(self, terms, page=1, limit=10):
+        """Return (results, estimated total) for one page of results"""
+        # Term order and repeats don't change BM25, so they share a cache entry
+        key = tuple(sorted(set(terms)))
+        wanted = page * limit
+        cached = self.result_cache.get(key)
+        if cached is None or (len(cached[0]) < wanted and cached[2]):
+            depth = max(self.result_depth, wanted)
+            ranked = self.top_k(terms, depth)
+            # (ranking, total, whether pages past the ranking may exist)
+            cached = (ranked, self.estimate_total(terms), len(ranked) == depth)
+            self.result_cache.put(key, cached)
+
+        ranked, total, _ = cached
+        return ranked[(page - 1) * limit:wanted], total
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """GET /search?q=...&page=...&limit=... -> JSON, in the shape the query-engine API returns"""
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path != "/search":
+            self.send_error(404)
+            return
+
+        params = parse_qs(parsed.query)
+        engine = self.server.current_engine()
+        terms = engine.parse_query(params.get("q", [""])[0])
+        try:
+            page = max(1, int(params.get("page", ["1"])[0]))
+            limit = max(1, int(params.get("limit", ["10"])[0]))
+        except ValueError:
+            self.send_error(400, "page and limit must be integers")
+            return
+
+        ranked, total = engine.search(terms, page, limit)
+        urls = self.server.lookup_urls([page_id for page_id, _ in ranked])
+        results = [
+            {"url": urls[page_id], "relevance_score": score}
+            for page_id, score in ranked if page_id in urls
+        ]
+
+        body = json.dumps({"results": results, "total": total}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SearchServer(ThreadingHTTPServer):
+    """
+    Serves an engine over one segment file. When export-index publishes a
+    new segment (a new index generation), the next request after
+    `reload_interval` seconds opens it behind a fresh engine, which drops
+    every cached result and postings list of the old one.
+    """
+
+    def __init__(self, address, engine, db, reload_interval=5.0):
+        super().__init__(address, SearchHandler)
+        self.engine = engine
+        self.db = db
+        self.reload_interval = reload_interval
+        self.generation = 0
+        self.segment_id = self._segment_id()
+        self.last_check = time.monotonic()
+        self.reload_lock = threading.Lock()
+
+    def _segment_id(self):
+        try:
+            stat = os.stat(self.engine.segment.path)
+            return stat.st_ino, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def current_engine(self):
+        now = time.monotonic()
+        if now - self.last_check < self.reload_interval or not self.reload_lock.acquire(blocking=False):
+            return self.engine
+        try:
+            self.last_check = now
+            segment_id = self._segment_id()
+            if segment_id is not None and segment_id != self.segment_id:
+                old = self.engine
+                static_scores = load_static_scores(self.db) if old.static_scores is not None else None
+                # The old segment's map is released once requests still using it finish
+                self.engine = old.with_segment(SegmentReader(old.segment.path), static_scores)
+                self.segment_id = segment_id
+                self.generation += 1
+                print(f"[INFO] Loaded index generation {self.generation} ({self.engine.segment.num_docs} pages)")
+        except Exception as e:
+            print(f"[ERROR]: Could not reload the index segment: {e}")
+        finally:
+            self.reload_lock.release()
+        return self.engine
+
+    def lookup_urls(self, page_ids):
+        if not page_ids:
+            return {}
+        try:
+            placeholders = ", ".join(["%s"] * len(page_ids))
+            rows = self.db.execute(f"SELECT id, url FROM crawler_queue WHERE id IN ({placeholders})",
+                                   tuple(page_ids), dictionary=True, fetch=True)
+            return {row['id']: row['url'] for row in rows}
+        except Exception as e:
+            print(f"[DB Error] Failed to look up URLs: {e}")
+            return {}
+        finally:
+            # Each request runs on its own thread; hand its connection back to the pool
+            self.db.release()
+
+
+def run_search_server(host, user, password, database, segment_path="data/index/index.seg", port=5001,
+                      pagerank_weight=1.0):
+    print("[INFO] Starting search server...")
+    db = DatabaseController(
+        host=host,
+        user=user,
+        password=password,
+        database=database,
+        pool_size=16  # Request threads each borrow a connection
+    )
+
+    segment = SegmentReader(segment_path)
+    # PageRank scores from `main.py pagerank`, blended into BM25
+    static_scores = load_static_scores(db) if pagerank_weight else None
+    if static_scores:
+        print(f"[INFO] Loaded PageRank scores for up to {len(static_scores)} page ids (weight {pagerank_weight})")
+    engine = QueryEngine(segment, static_scores=static_scores, static_weight=pagerank_weight)
+    server = SearchServer(("0.0.0.0", port), engine, db)
+    print(f"[INFO] Search server listening on port {port} ({segment.num_terms} terms, {segment.num_docs} pages)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[INFO] Search server stopped.")
+    finally:
+        server.server_close()
+        segment.close()
+        db.close()
@@ -0,0 +1,262 @@
+from database.db import DatabaseController
+from services.indexer.lexicon import Lexicon
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+# Segment file layout (all integers big-endian):
+#
+#   header       MAGIC, version, term count, doc count, offsets of the
+#                term dictionary, term offset table and doc table, and the
+#                total document length
+#   postings     per term: (page_id delta, tf) pairs as varints, page ids ascending
+#   dictionary   per term, sorted: u16 length, utf-8 term, u32 df, u32 max tf,
+#                u64 postings offset, u32 postings length
+#   term offsets u64 file offset of each dictionary entry, for binary search
+#   doc table    (u32 page_id, u32 length) sorted by page_id
+
+MAGIC = b"SEIX"
+VERSION = 1
+
+HEADER = struct.Struct(">4sIIIQQQQ")
+TERM_LEN = struct.Struct(">H")
+TERM_INFO = struct.Struct(">IIQI")
+OFFSET = struct.Struct(">Q")
+DOC = struct.Struct(">II")
+
+TermInfo = namedtuple("TermInfo", ["df", "max_tf", "offset", "length"])
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data):
+    """Decode a buffer of concatenated varints"""
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values
+
+
+def encode_postings(postings):
+    """Delta + varint encode [(page_id, tf), ...] sorted by page_id"""
+    out = bytearray()
+    previous = 0
+    for page_id, tf in postings:
+        encode_varint(page_id - previous, out)
+        encode_varint(tf, out)
+        previous = page_id
+    return bytes(out)
+
+
+def decode_postings(data):
+    values = decode_varints(data)
+    postings = []
+    page_id = 0
+    for i in range(0, len(values), 2):
+        page_id += values[i]
+        postings.append((page_id, values[i + 1]))
+    return postings
+
+
+class SegmentWriter:
+    """
+    Writes a segment from terms supplied in any order, each term once.
+    Postings go to disk as each term arrives; only the dictionary and doc
+    lengths stay in memory, and the dictionary is sorted on close.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(b"\0" * HEADER.size)
+        self.terms = []
+        self.doc_lengths = {}
+
+    def add_term(self, term, postings):
+        """Add one term with its [(page_id, tf), ...] postings"""
+        # Merge duplicate page ids (e.g. a page indexed twice) and sort
+        merged = {}
+        for page_id, tf in postings:
+            merged[page_id] = merged.get(page_id, 0) + tf
+        if not merged:
+            return
+        postings = sorted(merged.items())
+
+        for page_id, tf in postings:
+            self.doc_lengths[page_id] = self.doc_lengths.get(page_id, 0) + tf
+
+        data = encode_postings(postings)
+        offset = self.file.tell()
+        self.file.write(data)
+        self.terms.append((term.encode("utf-8"), len(postings), max(tf for _, tf in postings), offset, len(data)))
+
+    def close(self):
+        """Write the dictionary, offset table and doc table, then publish the segment"""
+        # UTF-8 byte order is code point order, so this matches str comparison in lookup()
+        self.terms.sort()
+        for (term, *_), (next_term, *_) in zip(self.terms, self.terms[1:]):
+            if term == next_term:
+                raise ValueError(f"Term {term.decode('utf-8')!r} was added more than once")
+
+        dict_offset = self.file.tell()
+        entry_offsets = []
+        for term, df, max_tf, offset, length in self.terms:
+            entry_offsets.append(self.file.tell())
+            self.file.write(TERM_LEN.pack(len(term)))
+            self.file.write(term)
+            self.file.write(TERM_INFO.pack(df, max_tf, offset, length))
+
+        offsets_offset = self.file.tell()
+        for entry_offset in entry_offsets:
+            self.file.write(OFFSET.pack(entry_offset))
+
+        docs_offset = self.file.tell()
+        for page_id in sorted(self.doc_lengths):
+            self.file.write(DOC.pack(page_id, self.doc_lengths[page_id]))
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(self.terms), len(self.doc_lengths),
+                                    dict_offset, offsets_offset, docs_offset, sum(self.doc_lengths.values())))
+        self.file.close()
+        # Readers never see a half-written segment
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Discard the segment being written, leaving any published one in place"""
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class SegmentReader:
+    """Memory-mapped, read-only view of a segment file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.num_terms, self.num_docs, self.dict_offset,
+         self.offsets_offset, self.docs_offset, self.total_length) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} index segment")
+
+        self.avg_doc_length = self.total_length / self.num_docs if self.num_docs else 0.0
+
+    def _entry(self, index):
+        """Return (term, TermInfo) for the index-th dictionary entry"""
+        (entry_offset,) = OFFSET.unpack_from(self.map, self.offsets_offset + index * OFFSET.size)
+        (length,) = TERM_LEN.unpack_from(self.map, entry_offset)
+        start = entry_offset + TERM_LEN.size
+        term = self.map[start:start + length].decode("utf-8")
+        return term, TermInfo(*TERM_INFO.unpack_from(self.map, start + length))
+
+    def lookup(self, term):
+        """Binary search the term dictionary; returns TermInfo or None"""
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_term, info = self._entry(mid)
+            if entry_term == term:
+                return info
+            if entry_term < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def document_frequency(self, term):
+        info = self.lookup(term)
+        return info.df if info else 0
+
+    def postings(self, term):
+        """Return [(page_id, tf), ...] for a term, sorted by page_id"""
+        info = self.lookup(term)
+        if info is None:
+            return []
+        return decode_postings(self.map[info.offset:info.offset + info.length])
+
+    def terms(self):
+        for i in range(self.num_terms):
+            yield self._entry(i)
+
+    def doc_length(self, page_id):
+        lo, hi = 0, self.num_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            doc_id, length = DOC.unpack_from(self.map, self.docs_offset + mid * DOC.size)
+            if doc_id == page_id:
+                return length
+            if doc_id < page_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return 0
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def export_segment(db, path, batch_size=10000):
+    """Build a segment from the existing inverted_index table"""
+    print(f"[SEGMENT]: Exporting inverted_index to {path}")
+    terms = Lexicon(db).terms_by_id()
+    writer = SegmentWriter(path)
+    term_id = None
+    postings = []
+
+    # One ordered scan through a server-side cursor; postings arrive grouped by term id
+    rows = db.stream_rows("inverted_index", batch_size=batch_size, columns="term_id, page_id, frequency",
+                          key="term_id, page_id", unbuffered=True)
+    try:
+        for row in rows:
+            if row['term_id'] != term_id:
+                if postings and term_id in terms:
+                    writer.add_term(terms[term_id], postings)
+                term_id = row['term_id']
+                postings = []
+            postings.append((row['page_id'], row['frequency']))
+        if postings and term_id in terms:
+            writer.add_term(terms[term_id], postings)
+    except Exception as e:
+        # A truncated segment would be hot-swapped in by the search server
+        writer.abort()
+        print(f"[SEGMENT]: Export aborted, {path} left unchanged: {e}")
+        raise
+
+    writer.close()
+    print(f"[SEGMENT]: Wrote {len(writer.terms)} terms for {len(writer.doc_lengths)} pages")
+
+
+def run_index_export(host, user, password, database, path="data/index/index.seg"):
+    print("[INFO] Exporting index segment...")
+    db = DatabaseController(
+        host=host,
+        user=user,
+        password=password,
+        database=database
+    )
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        export_segment(db, path)
+    finally:
+        db.close()
@@ -0,0 +1,44 @@
+// LRU cache with a TTL whose entries are tagged with the index generation they were computed for
+export class QueryCache<T> {
+    private entries = new Map<string, { value: T; generation: number; expires: number }>();
+    hits = 0;
+    misses = 0;
+
+    /**
+     * @param maxEntries Entries kept before the least recently used is evicted.
+     * @param ttlMs Milliseconds an entry stays valid, even within one generation.
+     */
+    constructor(private maxEntries: number, private ttlMs: number) {}
+
+    /**
+     * Returns the cached value, or undefined if it is missing, expired or from another generation.
+     */
+    get(key: string, generation: number): T | undefined {
+        const entry = this.entries.get(key);
+        if (entry) {
+            this.entries.delete(key);
+            if (entry.generation === generation && entry.expires > Date.now()) {
+                // Re-inserting moves the key to the most recently used end
+                this.entries.set(key, entry);
+                this.hits++;
+                return entry.value;
+            }
+        }
+        this.misses++;
+        return undefined;
+    }
+
+    set(key: string, generation: number, value: T): void {
+        if (this.maxEntries <= 0) return;
+        this.entries.delete(key);
+        this.entries.set(key, { value, generation, expires: Date.now() + this.ttlMs });
+        while (this.entries.size > this.maxEntries) {
+            // Maps iterate in insertion order, so the first key is the least recently used
+            this.entries.delete(this.entries.keys().next().value as string);
+        }
+    }
+
+    get size(): number {
+        return this.entries.size;
+    }
+}
@@ -1,7 +1,126 @@
 import pool from "../db/db";
+import { QueryCache } from "./queryCache";
+
+// Ranked results kept per normalized query; later pages are sliced from them
+const RESULT_DEPTH = Number(process.env.QUERY_CACHE_DEPTH ?? 100);
+// How often the index generation is re-read, so cache hits don't cost a query each
+const GENERATION_CHECK_MS = 1000;
+
+// Posting lists longer than this are read for every query instead of being cached
+const POSTINGS_MAX_CACHED = Number(process.env.POSTINGS_CACHE_MAX_LENGTH ?? 100000);
+
+type RankedResults = { rows: any[]; total: number; exhausted: boolean };
+// One term's postings as parallel arrays, with each page's PageRank score
+type Postings = { pageIds: number[]; frequencies: number[]; pageRanks: number[] };
 
 // Service class for handling search queries
 export class QueryService {
+    private resultCache = new QueryCache<RankedResults>(
+        Number(process.env.QUERY_CACHE_SIZE ?? 10000),
+        Number(process.env.QUERY_CACHE_TTL_MS ?? 5 * 60 * 1000)
+    );
+    // Hot terms: term -> lexicon id, or null for a term that is not indexed (yet)
+    private termCache = new QueryCache<number | null>(100000, 60 * 60 * 1000);
+    // Hot terms: lexicon id -> postings, so queries sharing a term don't read it from MySQL again
+    private postingsCache = new QueryCache<Postings>(
+        Number(process.env.POSTINGS_CACHE_SIZE ?? 10000),
+        Number(process.env.QUERY_CACHE_TTL_MS ?? 5 * 60 * 1000)
+    );
+    private generation = 0;
+    private generationCheckedAt = 0;
+
+    /**
+     * Reads the index generation the indexer bumps whenever it commits postings, at most once per GENERATION_CHECK_MS.
+     * @returns The current generation (0 if the indexer has not created it yet).
+     */
+    private async currentGeneration(): Promise<number> {
+        const now = Date.now();
+        if (now - this.generationCheckedAt < GENERATION_CHECK_MS) return this.generation;
+        this.generationCheckedAt = now;
+        try {
+            const [rows] = await pool.query(`SELECT generation FROM index_generation WHERE id = 1`);
+            this.generation = Number((rows as any[])[0]?.generation ?? 0);
+        } catch (error) {
+            console.error('Could not read the index generation:', error);
+        }
+        return this.generation;
+    }
+
+    /**
+     * Resolves terms to lexicon ids, querying only the terms missing from the term cache.
+     * @param terms Lower-cased, distinct terms.
+     * @param generation Current index generation.
+     * @returns Ids of the terms that are indexed.
+     */
+    private async resolveTermIds(terms: string[], generation: number): Promise<number[]> {
+        const ids: number[] = [];
+        const missing: string[] = [];
+        for (const term of terms) {
+            const id = this.termCache.get(term, generation);
+            if (id === undefined) missing.push(term);
+            else if (id !== null) ids.push(id);
+        }
+
+        if (missing.length) {
+            const [termRows] = await pool.query(
+                `SELECT id, term FROM lexicon WHERE term IN (${missing.map(() => '?').join(', ')})`,
+                missing
+            );
+            const found = new Map<string, number>(
+                (termRows as any[]).map(row => [row.term, row.id] as [string, number])
+            );
+            for (const term of missing) {
+                const id = found.get(term) ?? null;
+                this.termCache.set(term, generation, id);
+                if (id !== null) ids.push(id);
+            }
+        }
+        return ids;
+    }
+
+    /**
+     * Loads the postings of terms, querying only the terms missing from the postings cache.
+     * @param termIds Lexicon ids of distinct terms.
+     * @param generation Current index generation.
+     * @returns The postings of each term, in the order of termIds.
+     */
+    private async loadPostings(termIds: number[], generation: number): Promise<Postings[]> {
+        const lists = new Map<number, Postings>();
+        const missing: number[] = [];
+        for (const id of termIds) {
+            const postings = this.postingsCache.get(String(id), generation);
+            if (postings) lists.set(id, postings);
+            else missing.push(id);
+        }
+
+        if (missing.length) {
+            for (const id of missing) lists.set(id, { pageIds: [], frequencies: [], pageRanks: [] });
+            const [rows] = await pool.query(
+                `
+                SELECT ii.term_id, ii.page_id, ii.frequency, COALESCE(pr.score, 0) AS page_rank
+                FROM inverted_index ii
+                JOIN crawler_queue cq ON ii.page_id = cq.id
+                LEFT JOIN page_rank pr ON pr.page_id = ii.page_id
+                WHERE ii.term_id IN (${missing.map(() => '?').join(', ')})
+                `,
+                missing
+            );
+            for (const row of rows as any[]) {
+                const postings = lists.get(Number(row.term_id))!;
+                postings.pageIds.push(Number(row.page_id));
+                postings.frequencies.push(Number(row.frequency));
+                postings.pageRanks.push(Number(row.page_rank));
+            }
+            for (const id of missing) {
+                const postings = lists.get(id)!;
+                if (postings.pageIds.length <= POSTINGS_MAX_CACHED) {
+                    this.postingsCache.set(String(id), generation, postings);
+                }
+            }
+        }
+        return termIds.map(id => lists.get(id)!);
+    }
+
     /**
      * Searches for pages matching the given keywords.
      * @param keywords Array of keywords to search for.
@@ -17,48 +136,118 @@ export class QueryService {
         // Return empty result if no keywords provided
         if (!keywords.length) return { results: [], total: 0 };
 
-        // Prepare SQL placeholders for keyword parameters
-        const placeholders = keywords.map(() => '?').join(', ');
+        // Delegate to the Python BM25 engine when one is configured
+        if (process.env.SEARCH_ENGINE_URL) {
+            return this.searchWithEngine(keywords, page, limit);
+        }
+
+        // Keyword order and repeats don't change the ranking, so they share a cache entry
+        const terms = [...new Set(keywords.map(k => k.toLowerCase()))].sort();
+        const key = `${keywords.length}:${terms.join(' ')}`;
         const offset = (page - 1) * limit;
+        const generation = await this.currentGeneration();
 
-        const totalInputKeywords = keywords.length;
-
-        // Query to fetch matching pages with relevance score
-        const [results] = await pool.query(
-            `
-            SELECT 
-                cq.url,
-                SUM(ii.frequency) AS total_frequency,
-                COUNT(DISTINCT ii.keyword) AS matched_keywords,
-                (SUM(ii.frequency) * COUNT(DISTINCT ii.keyword) / ?) AS relevance_score
-            FROM inverted_index ii
-            JOIN crawler_queue cq ON ii.page_id = cq.id
-            WHERE ii.keyword IN (${placeholders})
-            GROUP BY ii.page_id
-            ORDER BY relevance_score DESC
-            LIMIT ? OFFSET ?
-            `,
-            [totalInputKeywords, ...keywords, limit, offset]
-        );
+        let ranked = this.resultCache.get(key, generation);
+        if (!ranked || (ranked.rows.length < offset + limit && !ranked.exhausted)) {
+            ranked = await this.rank(terms, keywords.length, Math.max(RESULT_DEPTH, offset + limit), generation);
+            this.resultCache.set(key, generation, ranked);
+        }
 
-        // Query to count total number of matching pages
-        const [countRows] = await pool.query(
-            `
-            SELECT COUNT(DISTINCT ii.page_id) AS total
-            FROM inverted_index ii
-            JOIN crawler_queue cq ON ii.page_id = cq.id
-            WHERE ii.keyword IN (${placeholders})
-            `,
-            keywords
+        return {
+            results: ranked.rows.slice(offset, offset + limit),
+            total: ranked.total,
+        };
+    }
+
+    /**
+     * Ranks the top pages for a set of terms from their (cached) postings.
+     * @param terms Lower-cased, distinct terms.
+     * @param totalInputKeywords Number of keywords in the request, used in the relevance score.
+     * @param depth Number of ranked pages to fetch.
+     * @param generation Current index generation.
+     * @returns The ranked rows, the total match count, and whether there are no rows past them.
+     */
+    private async rank(
+        terms: string[],
+        totalInputKeywords: number,
+        depth: number,
+        generation: number
+    ): Promise<RankedResults> {
+        // Resolve keywords to lexicon term ids once; postings are stored by id
+        const termIds = await this.resolveTermIds(terms, generation);
+        if (!termIds.length) return { rows: [], total: 0, exhausted: true };
+
+        // PageRank (0..1, from `python main.py pagerank`) scales the keyword score by up to 1 + weight
+        const pageRankWeight = Number(process.env.PAGERANK_WEIGHT ?? 1);
+
+        // Sum each page's frequencies over the matched terms
+        const pages = new Map<number, { frequency: number; matched: number; pageRank: number }>();
+        for (const postings of await this.loadPostings(termIds, generation)) {
+            for (let i = 0; i < postings.pageIds.length; i++) {
+                const page = pages.get(postings.pageIds[i]);
+                if (page) {
+                    page.frequency += postings.frequencies[i];
+                    page.matched++;
+                } else {
+                    pages.set(postings.pageIds[i], {
+                        frequency: postings.frequencies[i],
+                        matched: 1,
+                        pageRank: postings.pageRanks[i],
+                    });
+                }
+            }
+        }
+
+        const top = [...pages]
+            .map(([pageId, page]) => ({
+                pageId,
+                total_frequency: page.frequency,
+                matched_keywords: page.matched,
+                relevance_score: (page.frequency * page.matched / totalInputKeywords)
+                    * (1 + pageRankWeight * page.pageRank),
+            }))
+            .sort((a, b) => b.relevance_score - a.relevance_score)
+            .slice(0, depth);
+        if (!top.length) return { rows: [], total: 0, exhausted: true };
+
+        // Only the pages shown need their URL
+        const [urlRows] = await pool.query(
+            `SELECT id, url FROM crawler_queue WHERE id IN (${top.map(() => '?').join(', ')})`,
+            top.map(page => page.pageId)
+        );
+        const urls = new Map<number, string>(
+            (urlRows as any[]).map(row => [Number(row.id), row.url] as [number, string])
         );
 
-        // Extract total count from query result
-        const total = (countRows as any[])[0]?.total || 0;
+        const rows = top
+            .filter(page => urls.has(page.pageId))
+            .map(({ pageId, ...page }) => ({ url: urls.get(pageId), ...page }));
+        return { rows, total: pages.size, exhausted: top.length === pages.size };
+    }
 
-        // Return results and total count
-        return {
-            results: results as any[],
-            total,
-        };
+    /**
+     * Ranks pages with the Python query engine (BM25 over the index segment).
+     * @param keywords Array of keywords to search for.
+     * @param page Page number for pagination.
+     * @param limit Number of results per page.
+     * @returns An object containing the search results and an estimated total count.
+     */
+    private async searchWithEngine(
+        keywords: string[],
+        page: number,
+        limit: number
+    ): Promise<{ results: any[]; total: number }> {
+        const params = new URLSearchParams({
+            q: keywords.join(' '),
+            page: String(page),
+            limit: String(limit),
+        });
+
+        const response = await fetch(`${process.env.SEARCH_ENGINE_URL}/search?${params}`);
+        if (!response.ok) {
+            throw new Error(`Search engine responded with ${response.status}`);
+        }
+
+        return (await response.json()) as { results: any[]; total: number };
     }
-}
\ No newline at end of file
+}
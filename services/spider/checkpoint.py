@@ -0,0 +1,299 @@
+from services.spider.frontier import FingerprintSet, BloomFilter, create_visited_filter
+from array import array
+import itertools
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+
+# Snapshot file layout (integers big-endian):
+#
+#   header    MAGIC, version, visited filter kind, visited count, then the
+#             byte lengths of the visited and frontier sections
+#   visited   exact: newline-joined URLs; fingerprint: native u64 array;
+#             bloom: BLOOM header followed by the raw bit array
+#   frontier  newline-joined pending URLs
+#
+# The write-ahead log holds every change made since the snapshot as
+# (op, u32 length, utf-8 url) records: ENQUEUED when a URL enters the
+# frontier, VISITED once its 'processed' row is committed. While a
+# snapshot is being written, the log it covers is kept as wal.old.
+
+MAGIC = b"CRCK"
+VERSION = 1
+
+HEADER = struct.Struct(">4sIBQQQ")
+BLOOM = struct.Struct(">QQIQ")  # capacity, bit count, hash count, added count
+RECORD = struct.Struct(">cI")
+
+KINDS = {"exact": 0, "fingerprint": 1, "bloom": 2}
+ENQUEUED = b"P"
+VISITED = b"V"
+
+# URLs (or fingerprints) serialized per write, so a background snapshot
+# hands the GIL back to the crawl loop between chunks
+SNAPSHOT_CHUNK = 65536
+
+
+class CrawlCheckpoint:
+    """
+    Snapshot of the crawler's visited filter and frontier, plus a delta log.
+
+    A restart maps the last snapshot and replays the log written since,
+    instead of reading every crawler_queue row back from MySQL. A new
+    snapshot is taken every `snapshot_interval` seconds or
+    `snapshot_records` log records, after which the log starts over.
+    Snapshots can be written on a background thread from a copy of the
+    visited filter, so the crawl loop only pays for the copy.
+    """
+
+    def __init__(self, path, snapshot_interval=300.0, snapshot_records=1_000_000, flush_interval=1.0):
+        self.path = path
+        self.snapshot_path = os.path.join(path, "snapshot.bin")
+        self.log_path = os.path.join(path, "wal.log")
+        self.old_log_path = os.path.join(path, "wal.old")
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_records = snapshot_records
+        self.flush_interval = flush_interval
+
+        os.makedirs(path, exist_ok=True)
+        self.log = None
+        self.records = 0
+        self.last_snapshot = time.monotonic()
+        self.last_flush = time.monotonic()
+        # VISITED records come from the queue writer's thread
+        self.lock = threading.Lock()
+        self.snapshot_thread = None
+
+    def _load_visited(self, data, kind, capacity, false_positive_rate):
+        if kind == "exact":
+            text = data.decode("utf-8")
+            return set(text.split("\n")) if text else set()
+
+        if kind == "fingerprint":
+            fingerprints = array("Q")
+            fingerprints.frombytes(data)
+            visited = FingerprintSet()
+            visited.fingerprints = set(fingerprints)
+            return visited
+
+        stored_capacity, num_bits, num_hashes, added = BLOOM.unpack_from(data, 0)
+        visited = BloomFilter(capacity, false_positive_rate)
+        if (stored_capacity, num_bits, num_hashes) != (visited.capacity, visited.num_bits, visited.num_hashes):
+            raise ValueError("Bloom filter was sized differently")
+        visited.bits = bytearray(data[BLOOM.size:])
+        visited.count = added
+        return visited
+
+    def _read_snapshot(self, kind, capacity, false_positive_rate):
+        with open(self.snapshot_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, kind_code, _, visited_length, frontier_length = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a version %d crawler checkpoint" % VERSION)
+            if kind_code != KINDS[kind]:
+                raise ValueError("Checkpoint was written with a different visited filter")
+
+            start = HEADER.size
+            visited = self._load_visited(mapped[start:start + visited_length], kind, capacity, false_positive_rate)
+            start += visited_length
+            frontier_text = mapped[start:start + frontier_length].decode("utf-8")
+            frontier = frontier_text.split("\n") if frontier_text else []
+            return visited, frontier
+        finally:
+            mapped.close()
+
+    def _replay(self, path, visited, frontier):
+        """Apply a log to a loaded snapshot; a torn final record is ignored"""
+        pending = dict.fromkeys(frontier)
+        replayed = 0
+        with open(path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            op, length = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + length
+            if end > len(data):
+                break
+            url = data[offset + RECORD.size:end].decode("utf-8")
+            if op == ENQUEUED:
+                pending[url] = None
+            elif op == VISITED:
+                visited.add(url)
+            offset = end
+            replayed += 1
+
+        return [url for url in pending if url not in visited], replayed
+
+    def load(self, kind, capacity, false_positive_rate):
+        """Return (visited, frontier URLs) from the last checkpoint, or None if there is none"""
+        has_snapshot = os.path.exists(self.snapshot_path)
+        logs = [path for path in (self.old_log_path, self.log_path) if os.path.exists(path)]
+        if not has_snapshot and not logs:
+            return None
+
+        try:
+            if has_snapshot:
+                visited, frontier = self._read_snapshot(kind, capacity, false_positive_rate)
+            else:
+                visited, frontier = create_visited_filter(kind, capacity, false_positive_rate), []
+
+            replayed = 0
+            # wal.old is older than wal.log; it is left over if a snapshot did not complete
+            for path in logs:
+                frontier, count = self._replay(path, visited, frontier)
+                replayed += count
+            print(f"[CHECKPOINT]: Loaded snapshot and replayed {replayed} log records")
+            return visited, frontier
+        except Exception as e:
+            print(f"[CHECKPOINT]: Could not load checkpoint from {self.path}: {e}")
+            return None
+
+    def open_log(self):
+        self.log = open(self.log_path, "ab")
+
+    def _append(self, op, url):
+        data = url.encode("utf-8")
+        with self.lock:
+            if self.log is None:
+                return
+            self.log.write(RECORD.pack(op, len(data)))
+            self.log.write(data)
+            self.records += 1
+
+            now = time.monotonic()
+            if now - self.last_flush >= self.flush_interval:
+                self.log.flush()
+                self.last_flush = now
+
+    def log_enqueued(self, url):
+        self._append(ENQUEUED, url)
+
+    def log_visited(self, url):
+        """Record a visited URL; only call this once its 'processed' row is committed"""
+        self._append(VISITED, url)
+
+    def due(self):
+        if self.snapshot_thread is not None and self.snapshot_thread.is_alive():
+            return False
+        return (self.records >= self.snapshot_records
+                or time.monotonic() - self.last_snapshot >= self.snapshot_interval)
+
+    def defer(self):
+        """Push the next snapshot back by a full interval"""
+        self.last_snapshot = time.monotonic()
+        self.records = 0
+
+    def _capture_visited(self, visited):
+        """Return (kind code, count, data) where data no longer changes with `visited`"""
+        if isinstance(visited, BloomFilter):
+            return KINDS["bloom"], len(visited), BLOOM.pack(visited.capacity, visited.num_bits,
+                                                            visited.num_hashes, visited.count) + bytes(visited.bits)
+        if isinstance(visited, FingerprintSet):
+            return KINDS["fingerprint"], len(visited), set(visited.fingerprints)
+        return KINDS["exact"], len(visited), set(visited)
+
+    def _rotate_log(self):
+        """Start a new log; the current one is kept as wal.old until the snapshot is durable"""
+        if self.log is not None:
+            self.log.close()
+        if os.path.exists(self.log_path):
+            if os.path.exists(self.old_log_path):
+                # The previous snapshot did not complete, so wal.old is still needed
+                with open(self.log_path, "rb") as current, open(self.old_log_path, "ab") as old:
+                    shutil.copyfileobj(current, old)
+            else:
+                os.replace(self.log_path, self.old_log_path)
+        self.log = open(self.log_path, "wb")
+        self.records = 0
+        self.last_snapshot = time.monotonic()
+
+    @staticmethod
+    def _write_lines(f, lines):
+        """Write newline-joined strings in chunks and return the byte count"""
+        length = 0
+        separator = b""
+        lines = iter(lines)
+        while True:
+            chunk = list(itertools.islice(lines, SNAPSHOT_CHUNK))
+            if not chunk:
+                return length
+            data = separator + "\n".join(chunk).encode("utf-8")
+            f.write(data)
+            length += len(data)
+            separator = b"\n"
+
+    def _write_visited(self, f, kind_code, data):
+        if kind_code == KINDS["bloom"]:
+            f.write(data)
+            return len(data)
+        if kind_code == KINDS["fingerprint"]:
+            length = 0
+            fingerprints = iter(data)
+            while True:
+                chunk = array("Q", itertools.islice(fingerprints, SNAPSHOT_CHUNK)).tobytes()
+                if not chunk:
+                    return length
+                f.write(chunk)
+                length += len(chunk)
+        return self._write_lines(f, data)
+
+    def _write_snapshot(self, kind_code, count, visited_data, frontier):
+        start = time.monotonic()
+        try:
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, kind_code, count, 0, 0))
+                visited_length = self._write_visited(f, kind_code, visited_data)
+                frontier_length = self._write_lines(f, frontier)
+                # Section lengths are only known now
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, VERSION, kind_code, count, visited_length, frontier_length))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            # Replaying wal.old over the new snapshot is harmless, so a crash
+            # between the replace and the remove loses nothing
+            if os.path.exists(self.old_log_path):
+                os.remove(self.old_log_path)
+            print(f"[CHECKPOINT]: Snapshot of {count} visited and {len(frontier)} pending URLs "
+                  f"written in {time.monotonic() - start:.2f} seconds")
+        except Exception as e:
+            print(f"[CHECKPOINT]: Could not write snapshot: {e}")
+
+    def snapshot(self, visited, frontier, background=False):
+        """
+        Write a full snapshot atomically and start a new log. Every URL in
+        `visited` must already have its 'processed' row committed. With
+        `background`, only the copy of `visited` happens on this thread.
+        """
+        self.wait()
+        kind_code, count, visited_data = self._capture_visited(visited)
+        with self.lock:
+            self._rotate_log()
+
+        args = (kind_code, count, visited_data, frontier)
+        if background:
+            self.snapshot_thread = threading.Thread(target=self._write_snapshot, args=args,
+                                                    name="checkpoint-snapshot", daemon=True)
+            self.snapshot_thread.start()
+        else:
+            self._write_snapshot(*args)
+
+    def wait(self):
+        """Wait for a background snapshot to finish"""
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join()
+            self.snapshot_thread = None
+
+    def close(self):
+        self.wait()
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
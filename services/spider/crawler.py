@@ -1,32 +1,97 @@
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse, urlunparse
-from collections import deque
+import asyncio
 import concurrent.futures
+import hashlib
+import itertools
+import os
 import time
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from database.db import DatabaseController
+from database.writer import GroupCommitWriter
+from storage.page_store import PageStore, shard_store_path
+from services.common.html_parser import parse_html, charset_from_content_type
+from services.common.fetch import Fetcher, RejectedResponse, create_session
+from services.common.host_cache import HostCache
+from services.common.metrics import STAGE_SECONDS, PAGES, QUEUE_DEPTH, start_metrics, REGISTRY
+from services.spider.frontier import HostFrontier, create_visited_filter
+from services.spider.shard import ShardCoordinator, DatabaseRouter
+from services.spider.checkpoint import CrawlCheckpoint
+from services.spider.link_graph import EdgeLog
 import datetime
 
+# Width of crawler_queue.url; longer URLs cannot be stored, so they are not crawled
+MAX_URL_LENGTH = 255
+
+
 class ResumableCrawler:
-    def __init__(self, seed_urls, max_workers=10, timeout=5, blacklist=None, db=None, buffer_limit=50):
+    def __init__(self, seed_urls, max_workers=10, timeout=5, blacklist=None, db=None, buffer_limit=500,
+                 visited_filter="exact", expected_urls=100_000_000, false_positive_rate=0.001,
+                 per_host_limit=2, host_delay=1.0, host_pools=1000, flush_interval=1.0, page_store=None,
+                 router=None, idle_wait=0.2, parser="stream", max_page_bytes=2 * 1024 * 1024, checkpoint=None,
+                 link_graph=None, host_cache=None):
         self.seed_urls = seed_urls
         self.blacklist = blacklist or []
-        self.visited = set()
-        self.queue = deque()
+        # "exact" keeps full URLs; "fingerprint" and "bloom" trade exactness for memory
+        self.visited_filter = visited_filter
+        self.expected_urls = expected_urls
+        self.false_positive_rate = false_positive_rate
+        self.visited = create_visited_filter(visited_filter, expected_urls, false_positive_rate)
+        # URLs dispatched but not finished; they only become visited once fetched
+        self.fetching = set()
+        # DNS answers, robots.txt rules and crawl delays, looked up once per host
+        self.host_cache = host_cache or HostCache()
+        # Per-host queues: dispatch picks whichever host is ready next, honouring Crawl-delay
+        self.queue = HostFrontier(per_host_limit=per_host_limit, host_delay=host_delay,
+                                  delay_for=self.host_cache.crawl_delay)
         self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.host_pools = host_pools
         self.timeout = timeout
+        self.parser = parser  # HTML parser backend, see services/common/html_parser.py
+        self.urls_crawled = 0
+        self.last_reported = 0
 
         self.db = db  # Database controller instance
-        self.insert_buffer = []
-        self.insert_buffer_limit = buffer_limit
+        self.page_store = page_store  # Raw bodies are kept here for the indexer
+        self.link_graph = link_graph  # Outbound edges of every fetched page, for PageRank
+
+        # In a sharded crawl this process only crawls the hosts the router assigns to it
+        self.router = router
+        self.routed = create_visited_filter(visited_filter, expected_urls, false_positive_rate) if router else None
+        self.idle_wait = idle_wait
+
+        # Snapshot + delta log of visited and frontier, for a fast restart.
+        # Set before the writer starts, whose commits are logged to it.
+        self.checkpoint = checkpoint
+
+        # Queue inserts and status changes are group-committed on a background
+        # connection. A URL never moves from 'processed' back to 'pending',
+        # and a pending row never clears the validators of a fetched page.
+        self.writer = GroupCommitWriter(
+            db.clone(),
+            "crawler_queue",
+            key_column="url",
+            updates={
+                "status": "IF(status = 'processed', status, VALUES(status))",
+                "timestamp": "VALUES(timestamp)",
+                "etag": "COALESCE(VALUES(etag), etag)",
+                "last_modified": "COALESCE(VALUES(last_modified), last_modified)",
+                "content_hash": "COALESCE(VALUES(content_hash), content_hash)"
+            },
+            batch_size=buffer_limit,
+            flush_interval=flush_interval,
+            component="crawler",
+            on_commit=self._rows_committed
+        )
 
         # Setup session with retry strategy
         self.session = self._create_session()
-        
-        # Load state from database or initialize with seed URLs
-        self.resume_from_db()
+        # Non-HTML responses are dropped from their headers; bodies are capped at max_page_bytes
+        self.fetcher = Fetcher(self.session, timeout=timeout, max_bytes=max_page_bytes, component="crawler",
+                               host_cache=self.host_cache)
+
+        # Load state from the checkpoint or database, or initialize with seed URLs
+        self.resume()
     
     def is_blacklisted(self, url):
         parsed = urlparse(url)
@@ -37,106 +102,210 @@ class ResumableCrawler:
         return False
 
     def _create_session(self):
-        session = requests.Session()
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=0.1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-
-        session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/115.0.0.0 Safari/537.36"
-        })
+        # One keep-alive pool per host, sized to the per-host concurrency cap,
+        # and enough pools that hosts in rotation are not evicted between fetches
+        return create_session(pool_connections=self.host_pools, pool_maxsize=self.per_host_limit,
+                              host_cache=self.host_cache)
+
+    def owns(self, url):
+        return self.router is None or self.router.owns(url)
 
-        return session
+    def has_work(self, in_flight=0):
+        """
+        Whether the crawl loop should keep going. In a sharded crawl this also
+        takes in links routed from other shards, and the loop runs until the
+        router says the crawl is over.
+        """
+        self.maybe_checkpoint()
+
+        if self.router is None:
+            return bool(self.queue) or in_flight > 0
+
+        for url in self.router.receive():
+            if self.is_new(url):
+                self.enqueue(url)
+        self.router.report(not self.queue and not in_flight, self.urls_crawled)
+        return not self.router.stopped()
+
+    def is_new(self, url):
+        return url not in self.visited and url not in self.queue and url not in self.fetching
+
+    def enqueue(self, url):
+        """Add a URL to the frontier, logging it for the next restart"""
+        self.queue.append(url)
+        if self.checkpoint:
+            self.checkpoint.log_enqueued(url)
+
+    def _rows_committed(self, rows):
+        """Writer callback: URLs are only logged as visited once their 'processed' row is in MySQL"""
+        checkpoint = self.checkpoint
+        if checkpoint is None:
+            return
+        for row in rows:
+            if row["status"] == "processed":
+                checkpoint.log_visited(row["url"])
+
+    def maybe_checkpoint(self):
+        if self.checkpoint and self.checkpoint.due():
+            # A snapshot may only mark URLs visited whose 'processed' rows are committed
+            if not self.writer.sync():
+                print("[CHECKPOINT]: Queue writes are failing; postponing the snapshot")
+                self.checkpoint.defer()
+                return
+            if self.link_graph is not None:
+                self.link_graph.flush()
+            # In-flight URLs are saved as pending: they are not visited until their fetch completes.
+            # The snapshot is written on a background thread from a copy of the visited set.
+            self.checkpoint.snapshot(self.visited, list(itertools.chain(self.queue, self.fetching)),
+                                     background=True)
+
+    def resume(self):
+        """Restore state from the last checkpoint if there is one, otherwise from the database"""
+        state = None
+        if self.checkpoint:
+            state = self.checkpoint.load(self.visited_filter, self.expected_urls, self.false_positive_rate)
+
+        if state is not None:
+            self.visited, frontier = state
+            for url in frontier:
+                self.queue.append(url)
+            print(f"Resuming from checkpoint with {len(self.visited)} visited and {len(self.queue)} pending URLs")
+            self.checkpoint.open_log()
+            if self.router is not None and not self.router.polls_pending:
+                self.recover_routed_links()
+            return
+
+        loaded = self.resume_from_db()
+        if self.checkpoint and not loaded:
+            # A snapshot of partial state would hide the database on the next start
+            print("[CHECKPOINT]: Database scan failed; checkpointing disabled for this run")
+            self.checkpoint = None
+        elif self.checkpoint:
+            # The next start can skip the table scan
+            self.checkpoint.snapshot(self.visited, list(self.queue))
+
+    def recover_routed_links(self):
+        """
+        Queue this shard's pending rows that the checkpoint does not know about.
+        Links routed from other shards are only in the checkpoint log once
+        received, and the log is not fsynced, but the sender saved each one as
+        a pending row, so a restarted shard reads them back from there.
+        """
+        recovered = 0
+        try:
+            for row in self.db.stream_rows("crawler_queue", batch_size=10000, where_clause="status = 'pending'",
+                                           columns="id, url", unbuffered=True):
+                if self.owns(row['url']) and self.is_new(row['url']):
+                    self.enqueue(row['url'])
+                    recovered += 1
+        except Exception as e:
+            print(f"Error reading pending URLs from database: {e}")
+        if recovered:
+            print(f"Recovered {recovered} pending URLs missing from the checkpoint")
 
     def normalize_url(self, url):
         parsed = urlparse(url)
         normalized = parsed._replace(query="", fragment="")
         return urlunparse(normalized)
     
-    def save_url_to_queue(self, url, status="pending"):
+    def save_url_to_queue(self, url, status="pending", validators=None):
         """Save a URL to the queue database table"""
-        self.insert_buffer.append({
+        if len(url) > MAX_URL_LENGTH:
+            print(f"[Skipped]: URL longer than {MAX_URL_LENGTH} characters: {url[:80]}...")
+            return
+        # Every row has the same columns so the writer can batch them together
+        validators = validators or {}
+        # An oversized validator is dropped rather than failing the whole row
+        etag = validators.get("etag")
+        if etag and len(etag) > 255:
+            etag = None
+        last_modified = validators.get("last_modified")
+        if last_modified and len(last_modified) > 64:
+            last_modified = None
+        self.writer.submit({
             "url": url,
             "status": status,
-            "timestamp": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            "timestamp": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_hash": validators.get("content_hash")
         })
-        
-        if len(self.insert_buffer) >= self.insert_buffer_limit:
-            self.db.insert_many("crawler_queue", self.insert_buffer)
-            self.insert_buffer.clear()
     
-    def mark_url_as_processed(self, url):
-        """Mark a URL as processed in the database"""
-        try:
-            cursor = self.db.connection.cursor()
-            sql = "UPDATE crawler_queue SET status = 'processed', timestamp = %s WHERE url = %s"
-            cursor.execute(sql, (datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), url))
-            self.db.connection.commit()
-            cursor.close()
-        except Exception as e:
-            print(f"Error marking URL as processed: {e}")
+    def mark_url_as_processed(self, url, validators=None):
+        """Mark a URL as processed in the database, with the validators of its response"""
+        self.save_url_to_queue(url, status="processed", validators=validators)
     
     def resume_from_db(self):
-        """Load crawler state from database"""
+        """Load crawler state from database; returns False if it could not be read"""
         try:
-            # Check if we have any data in the queue table
-            cursor = self.db.connection.cursor(dictionary=True)
-            
-            # First, load all processed URLs into visited set
-            cursor.execute("SELECT url FROM crawler_queue WHERE status = 'processed'")
-            processed_urls = cursor.fetchall()
-            
-            if processed_urls:
-                print(f"Found {len(processed_urls)} previously processed URLs")
-                for row in processed_urls:
+            # First, stream all processed URLs into the visited set
+            processed_count = 0
+            for row in self.db.stream_rows("crawler_queue", batch_size=10000, where_clause="status = 'processed'",
+                                           columns="id, url", unbuffered=True):
+                if self.owns(row['url']):
                     self.visited.add(row['url'])
+                    processed_count += 1
             
-            # Then load pending URLs into queue
-            cursor.execute("SELECT url FROM crawler_queue WHERE status = 'pending'")
-            pending_urls = cursor.fetchall()
+            if processed_count:
+                print(f"Found {processed_count} previously processed URLs")
             
-            if pending_urls:
-                print(f"Resuming crawl with {len(pending_urls)} pending URLs")
-                for row in pending_urls:
+            # Then load pending URLs into queue
+            pending_count = 0
+            for row in self.db.stream_rows("crawler_queue", batch_size=10000, where_clause="status = 'pending'",
+                                           columns="id, url", unbuffered=True):
+                if self.owns(row['url']):
                     self.queue.append(row['url'])
+                    pending_count += 1
+            
+            if pending_count:
+                print(f"Resuming crawl with {pending_count} pending URLs")
             else:
                 print("No pending URLs found. Starting with seed URLs.")
                 for url in self.seed_urls:
                     normalized_url = self.normalize_url(url)
+                    if not self.owns(normalized_url):
+                        continue
                     self.queue.append(normalized_url)
                     self.save_url_to_queue(normalized_url)
-            
-            cursor.close()
+            return True
             
         except Exception as e:
+            # stream_rows raises on a failed scan, so what was read so far is only part of the
+            # table; resume() must not snapshot it
             print(f"Error loading state from database: {e}")
-            print("Starting fresh with seed URLs")
-            # If there's an error, start with seed URLs
+            print(f"Continuing with the {len(self.queue)} pending URLs read so far plus seed URLs")
+            queued = set(self.queue)
             for url in self.seed_urls:
                 normalized_url = self.normalize_url(url)
+                if not self.owns(normalized_url) or normalized_url in self.visited or normalized_url in queued:
+                    continue
                 self.queue.append(normalized_url)
                 self.save_url_to_queue(normalized_url)
+            return False
 
     def extract_external_links(self, url):
         try:
-            response = self.session.get(url, timeout=self.timeout)
-            response.raise_for_status()
+            response = self.fetcher.get(url)
+            # Kept with the body so the indexer decodes it the same way
+            charset = charset_from_content_type(response.headers.get("Content-Type"))
+
+            if self.page_store:
+                self.page_store.put(url, response.content, charset)
+
+            # Kept so the page can later be refetched conditionally
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "content_hash": hashlib.sha1(response.content).hexdigest()
+            }
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+            with STAGE_SECONDS.time("crawler", "parse"):
+                page = parse_html(response.content, self.parser, want_text=False, charset=charset)
             links = []
 
             base_domain = urlparse(url).netloc
 
-            # Find all anchor tags with href attributes
-            for a_tag in soup.find_all('a', href=True):
-                href = a_tag['href']
+            for href in page.links:
                 full_url = urljoin(url, href)
                 parsed_url = urlparse(full_url)
 
@@ -149,89 +318,191 @@ class ResumableCrawler:
                     continue
                 
                 normalized_url = self.normalize_url(full_url)
+                if len(normalized_url) > MAX_URL_LENGTH:
+                    continue
                 links.append(normalized_url)
                 
-            return url, links
+            return url, links, validators
             
+        except RejectedResponse as e:
+            print(f"[Skipped]: {url}: {e}")
         except requests.exceptions.RequestException as e:
+            PAGES.inc("crawler", "failed")
             print(f"[Exception]: Error fetching {url}: {e}")
         except Exception as e:
+            PAGES.inc("crawler", "failed")
             print(f"[Exception]: An error occurred with {url}: {e}")
         
-        return url, []
+        return url, [], None
+
+    def next_url(self):
+        """Pop a URL from the next ready host, or None if it should be skipped"""
+        url = self.queue.pop_ready()
+        if url is None:
+            return None
+
+        if self.is_blacklisted(url):
+            # Mark blacklisted URLs as processed so we don't retry them
+            self.queue.release(url)
+            self.mark_url_as_processed(url)
+            return None
+
+        normalized_url = self.normalize_url(url)
+        if normalized_url in self.visited or normalized_url in self.fetching:
+            self.queue.release(url)
+            return None
+
+        self.fetching.add(normalized_url)
+        self.urls_crawled += 1
+        return normalized_url
+
+    def handle_result(self, url, links, validators, start_time):
+        """Record a finished fetch and enqueue the links it discovered"""
+        self.queue.release(url)
+        self.fetching.discard(url)
+        self.visited.add(url)
+
+        # Mark URL as processed
+        self.mark_url_as_processed(url, validators)
+        if self.link_graph is not None:
+            self.link_graph.add(url, links)
+
+        print(f"[Crawled]: {url} -> Found {len(links)} external links")
+        # Add new links to queue
+        for link in links:
+            if self.is_blacklisted(link):
+                continue
+
+            if not self.owns(link):
+                # Another shard crawls this host. The link is saved as pending
+                # too, so it survives a restart of either shard.
+                if link not in self.routed:
+                    self.routed.add(link)
+                    self.router.route(link)
+                    self.save_url_to_queue(link)
+                continue
+
+            if self.is_new(link):
+                self.enqueue(link)
+                self.save_url_to_queue(link)
+
+        QUEUE_DEPTH.set(len(self.queue), "crawler", "frontier")
+        QUEUE_DEPTH.set(len(self.fetching), "crawler", "fetching")
+
+        # Print progress
+        if len(self.visited) >= self.last_reported + 10:
+            elapsed = time.time() - start_time
+            print(f"Crawled {len(self.visited)} URLs in {elapsed:.2f} seconds ({len(self.visited)/elapsed:.2f} URLs/sec)")
+            self.last_reported = len(self.visited)
 
     def crawl(self):
         start_time = time.time()
-        urls_crawled = 0
         
         try:     
             # Use ThreadPoolExecutor for concurrent requests
             with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                while self.queue:
-                    # Get batch of URLs to process
-                    batch_size = min(self.max_workers, len(self.queue))
+                while self.has_work():
+                    # Get batch of URLs from hosts that are ready
                     batch = []
                         
-                    for _ in range(batch_size):
-                        if not self.queue:
-                            break
-                            
-                        url = self.queue.popleft()
-                            
-                        if self.is_blacklisted(url):
-                            # Mark blacklisted URLs as processed so we don't retry them
-                            self.mark_url_as_processed(url)
-                            continue
-
-                        normalized_url = self.normalize_url(url)
-                        if normalized_url not in self.visited:
-                            self.visited.add(normalized_url)
-                            batch.append(normalized_url)
-                            urls_crawled += 1
+                    while len(batch) < self.max_workers and self.queue.ready():
+                        url = self.next_url()
+                        if url:
+                            batch.append(url)
                                      
                     if not batch:
+                        # Every pending host is inside its politeness delay, or
+                        # a shard is waiting for links routed from other shards
+                        wait = self.queue.next_ready_in()
+                        if wait is None:
+                            wait = self.idle_wait
+                        if wait:
+                            time.sleep(wait)
                         continue
                             
                     # Submit batch for concurrent processing
                     future_to_url = {executor.submit(self.extract_external_links, url): url for url in batch}
                         
-                    last_reported = 0
                     for future in concurrent.futures.as_completed(future_to_url):
-                        url, links = future.result()
-                        
-                        # Mark URL as processed
-                        self.mark_url_as_processed(url)
-                            
-                        print(f"[Crawled]: {url} -> Found {len(links)} external links")            
-                        # Add new links to queue
-                        for link in links:
-                            if (not self.is_blacklisted(link) 
-                                and link not in self.visited 
-                                and link not in self.queue):
-                                self.queue.append(link)
-                                self.save_url_to_queue(link)
-                            
-                        # Print progress
-                        if len(self.visited) >= last_reported + 10:
-                            elapsed = time.time() - start_time
-                            print(f"Crawled {len(self.visited)} URLs in {elapsed:.2f} seconds ({len(self.visited)/elapsed:.2f} URLs/sec)")
-                            last_reported = len(self.visited)
+                        url, links, validators = future.result()
+                        self.handle_result(url, links, validators, start_time)
                 
         except KeyboardInterrupt:
             print("Crawl interrupted by user. Progress is saved to database. Run again to resume.")
         finally:
-            # Save any remaining items in buffer
-            if self.insert_buffer:
-                self.db.insert_many("crawler_queue", self.insert_buffer)
-                self.insert_buffer.clear()
+            self.finish(start_time)
 
-            elapsed = time.time() - start_time
-            print(f"\nCrawl completed or paused: {urls_crawled} URLs in {elapsed:.2f} seconds ({urls_crawled/elapsed:.2f} URLs/sec)")
-            print(f"Queue size at exit: {len(self.queue)}")
-            print(f"Total unique URLs visited: {len(self.visited)}")
-            
-            # Close the session
-            self.session.close()
+    async def _crawl_async(self, start_time):
+        """
+        Keep up to max_workers fetches in flight. Unlike crawl(), there is no
+        batch barrier: every completed fetch immediately frees a slot that is
+        refilled from the next ready host, so one slow host only holds one slot.
+        """
+        loop = asyncio.get_running_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        in_flight = set()
+
+        try:
+            while self.has_work(len(in_flight)):
+                # Top up the in-flight window from hosts that are ready
+                while len(in_flight) < self.max_workers and self.queue.ready():
+                    url = self.next_url()
+                    if url:
+                        in_flight.add(loop.run_in_executor(executor, self.extract_external_links, url))
+
+                # Wake up on the next completion, or when the next host becomes
+                # ready if there is a free slot for it
+                wait = None
+                if len(in_flight) < self.max_workers:
+                    wait = self.queue.next_ready_in()
+                    if wait is None:
+                        wait = self.idle_wait
+                if not in_flight:
+                    if wait:
+                        await asyncio.sleep(wait)
+                    continue
+
+                done, in_flight = await asyncio.wait(in_flight, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    url, links, validators = future.result()
+                    self.handle_result(url, links, validators, start_time)
+        finally:
+            # Don't wait on slow fetches when interrupted; their URLs stay pending
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def crawl_async(self):
+        start_time = time.time()
+
+        try:
+            asyncio.run(self._crawl_async(start_time))
+        except KeyboardInterrupt:
+            print("Crawl interrupted by user. Progress is saved to database. Run again to resume.")
+        finally:
+            self.finish(start_time)
+
+    def finish(self, start_time):
+        """Flush pending queue writes and print a summary"""
+        # Commit everything the writer still holds before exiting
+        all_written = self.writer.close()
+        if self.link_graph is not None:
+            self.link_graph.close()
+            print(f"Link graph edges recorded: {self.link_graph.edges_written}")
+
+        if self.checkpoint:
+            if all_written:
+                self.checkpoint.snapshot(self.visited, list(itertools.chain(self.queue, self.fetching)))
+            else:
+                # The log only holds committed URLs, so the last snapshot plus the log stay correct
+                print("[CHECKPOINT]: Skipping the final snapshot; some queue writes were not committed")
+            self.checkpoint.close()
+
+        elapsed = time.time() - start_time
+        print(f"\nCrawl completed or paused: {self.urls_crawled} URLs in {elapsed:.2f} seconds ({self.urls_crawled/elapsed:.2f} URLs/sec)")
+        print(f"Queue size at exit: {len(self.queue)}")
+        print(f"Total unique URLs visited: {len(self.visited)}")
+        
+        # Close the session
+        self.session.close()
 
 def load_list_from_file(path):
     """Load a list of URLs from a file"""
@@ -246,7 +517,39 @@ def load_list_from_file(path):
         print(f"[ERROR]: An error occurred while loading the file: {e}")
         return []
 
-def run_crawler(host, user, password, database):
+def create_crawler_tables(db):
+    """Create (or migrate) the crawler_queue table"""
+    # Crawler queue with status tracking
+    db.create_table("crawler_queue", {
+        "id": "INT AUTO_INCREMENT PRIMARY KEY",
+        "url": f"VARCHAR({MAX_URL_LENGTH}) NOT NULL UNIQUE",
+        "status": "ENUM('pending', 'processed') DEFAULT 'pending'",
+        "timestamp": "DATETIME DEFAULT CURRENT_TIMESTAMP",
+        "etag": "VARCHAR(255) DEFAULT NULL",
+        "last_modified": "VARCHAR(64) DEFAULT NULL",
+        "content_hash": "CHAR(40) DEFAULT NULL"
+    })
+    db.add_missing_columns("crawler_queue", {
+        "etag": "VARCHAR(255) DEFAULT NULL",
+        "last_modified": "VARCHAR(64) DEFAULT NULL",
+        "content_hash": "CHAR(40) DEFAULT NULL"
+    })
+
+def run_crawler(host, user, password, database, engine="threads", visited_filter="exact",
+                page_store_dir="data/page_store", shards=1, shard_index=None, router=None, parser="stream",
+                checkpoint_dir="data/checkpoint", link_graph_dir="data/link_graph", metrics_port=None,
+                metrics_dump=None):
+    if shard_index is not None and not 0 <= shard_index < shards:
+        raise ValueError(f"Shard index must be between 0 and {shards - 1}, got {shard_index}")
+    if shards > 1 and shard_index is None and router is None:
+        # Local sharded crawl: one process per shard, each calling back into run_crawler
+        ShardCoordinator(shards).run(run_crawler, host, user, password, database, engine=engine,
+                                     visited_filter=visited_filter, page_store_dir=page_store_dir, shards=shards,
+                                     parser=parser, checkpoint_dir=checkpoint_dir, link_graph_dir=link_graph_dir,
+                                     metrics_port=metrics_port,
+                                     metrics_dump=metrics_dump)
+        return
+
     print("Starting Crawler...")
     db = DatabaseController(
         host=host,
@@ -255,24 +558,50 @@ def run_crawler(host, user, password, database):
         database=database
     )
 
-    # Create table for crawler queue with status tracking
-    db.create_table("crawler_queue", {
-        "id": "INT AUTO_INCREMENT PRIMARY KEY",
-        "url": "VARCHAR(255) NOT NULL UNIQUE",
-        "status": "ENUM('pending', 'processed') DEFAULT 'pending'",
-        "timestamp": "DATETIME DEFAULT CURRENT_TIMESTAMP"
-    })
+    create_crawler_tables(db)
+
+    # One shard of a crawl spread over several machines sharing this database
+    if router is None and shard_index is not None:
+        router = DatabaseRouter(db, shard_index, shards)
+    if router is not None:
+        print(f"[INFO] Crawling shard {router.index} of {router.shards}")
+        page_store_dir = shard_store_path(page_store_dir, router.index, router.shards)
+        checkpoint_dir = shard_store_path(checkpoint_dir, router.index, router.shards)
+        link_graph_dir = shard_store_path(link_graph_dir, router.index, router.shards)
+        # Each shard serves its own metrics on the next port up, and dumps them next to the others
+        if metrics_port is not None:
+            metrics_port += router.index
+        if metrics_dump:
+            root, ext = os.path.splitext(metrics_dump)
+            metrics_dump = f"{root}.shard-{router.index:02d}-of-{router.shards:02d}{ext}"
+
+    if metrics_port is not None or metrics_dump:
+        start_metrics(metrics_port)
 
     seed_urls = load_list_from_file("../../../config/seed_urls.txt")
     blacklist = load_list_from_file("../../../config/blacklist.txt")
+    page_store = PageStore(page_store_dir)
 
     crawler = ResumableCrawler(
         seed_urls=seed_urls,
         max_workers=20,  
         timeout=5,
         blacklist=blacklist,
-        db=db
+        db=db,
+        visited_filter=visited_filter,
+        page_store=page_store,
+        router=router,
+        parser=parser,
+        checkpoint=CrawlCheckpoint(checkpoint_dir),
+        link_graph=EdgeLog(link_graph_dir)
     )
 
-    crawler.crawl()
-    db.close()
\ No newline at end of file
+    if engine == "async":
+        crawler.crawl_async()
+    else:
+        crawler.crawl()
+    page_store.close()
+    db.close()
+
+    if metrics_dump:
+        REGISTRY.dump(metrics_dump)
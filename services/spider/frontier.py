@@ -0,0 +1,192 @@
+from collections import deque
+from urllib.parse import urlparse
+import hashlib
+import heapq
+import itertools
+import math
+import time
+
+
+def url_fingerprint(url):
+    """64-bit fingerprint of a URL"""
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def url_host(url):
+    return urlparse(url).netloc.lower()
+
+
+def shard_of(url, shards):
+    """Shard that owns a URL: every URL of a host goes to the same shard"""
+    return url_fingerprint(url_host(url)) % shards
+
+
+class HostFrontier:
+    """
+    Pending URLs partitioned by host. Hosts wait in a heap keyed on the time
+    they may next be fetched, so dispatch always picks a host that is ready:
+    at most per_host_limit fetches in flight and host_delay seconds between
+    consecutive dispatches to the same host. `delay_for(url)` may return a
+    longer delay for a host (its robots.txt Crawl-delay), or None.
+    """
+
+    def __init__(self, per_host_limit=2, host_delay=1.0, delay_for=None):
+        self.per_host_limit = per_host_limit
+        self.host_delay = host_delay
+        self.delay_for = delay_for
+        self.host_queues = {}
+        self.members = set()
+        self.in_flight = {}
+        self.next_allowed = {}
+        self.ready_heap = []
+        self.scheduled = set()
+        self.counter = itertools.count()
+
+    def _schedule(self, host, now):
+        if host in self.scheduled or not self.host_queues.get(host):
+            return
+        if self.in_flight.get(host, 0) >= self.per_host_limit:
+            return
+        ready_at = max(now, self.next_allowed.get(host, 0.0))
+        heapq.heappush(self.ready_heap, (ready_at, next(self.counter), host))
+        self.scheduled.add(host)
+
+    def append(self, url):
+        if url in self.members:
+            return False
+        host = url_host(url)
+        self.host_queues.setdefault(host, deque()).append(url)
+        self.members.add(url)
+        self._schedule(host, time.monotonic())
+        return True
+
+    def ready(self, now=None):
+        """True if some host can be dispatched right now"""
+        now = time.monotonic() if now is None else now
+        return bool(self.ready_heap) and self.ready_heap[0][0] <= now
+
+    def next_ready_in(self, now=None):
+        """Seconds until the next host becomes ready, or None if nothing is schedulable"""
+        if not self.ready_heap:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.ready_heap[0][0] - now)
+
+    def pop_ready(self, now=None):
+        """Take a URL from the next ready host; call release() once it has been fetched"""
+        now = time.monotonic() if now is None else now
+        if not self.ready(now):
+            return None
+
+        _, _, host = heapq.heappop(self.ready_heap)
+        self.scheduled.discard(host)
+
+        queue = self.host_queues[host]
+        url = queue.popleft()
+        self.members.discard(url)
+        if not queue:
+            del self.host_queues[host]
+
+        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+        delay = self.host_delay
+        if self.delay_for is not None:
+            delay = max(delay, self.delay_for(url) or 0.0)
+        self.next_allowed[host] = now + delay
+        self._schedule(host, now)
+        return url
+
+    def release(self, url):
+        """Free the host slot taken by pop_ready()"""
+        now = time.monotonic()
+        host = url_host(url)
+        count = self.in_flight.get(host, 0) - 1
+        if count > 0:
+            self.in_flight[host] = count
+        else:
+            self.in_flight.pop(host, None)
+            # Forget idle hosts once their politeness delay has passed
+            if host not in self.host_queues and self.next_allowed.get(host, 0.0) <= now:
+                self.next_allowed.pop(host, None)
+        self._schedule(host, now)
+
+    def __contains__(self, url):
+        return url in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def __bool__(self):
+        return bool(self.members)
+
+    def __iter__(self):
+        for queue in self.host_queues.values():
+            yield from queue
+
+
+class FingerprintSet:
+    """Visited set that stores 64-bit URL fingerprints instead of full strings"""
+
+    def __init__(self):
+        self.fingerprints = set()
+
+    def add(self, url):
+        self.fingerprints.add(url_fingerprint(url))
+
+    def __contains__(self, url):
+        return url_fingerprint(url) in self.fingerprints
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+class BloomFilter:
+    """
+    Fixed-size visited filter. Memory is sized up front from the expected
+    number of URLs and the acceptable false-positive rate; a false positive
+    means a URL is wrongly treated as visited and skipped.
+    """
+
+    def __init__(self, capacity, false_positive_rate=0.001):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.num_bits = max(8, int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, url):
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, url):
+        added = False
+        for pos in self._positions(url):
+            byte, bit = divmod(pos, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                added = True
+        if added:
+            self.count += 1
+
+    def __contains__(self, url):
+        for pos in self._positions(url):
+            byte, bit = divmod(pos, 8)
+            if not self.bits[byte] & (1 << bit):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+
+def create_visited_filter(kind="exact", capacity=100_000_000, false_positive_rate=0.001):
+    """Build the visited filter used by the crawler"""
+    if kind == "exact":
+        return set()
+    if kind == "fingerprint":
+        return FingerprintSet()
+    if kind == "bloom":
+        return BloomFilter(capacity, false_positive_rate)
+    raise ValueError(f"Unknown visited filter: {kind}")
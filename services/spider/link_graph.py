@@ -0,0 +1,52 @@
+from services.spider.frontier import url_fingerprint
+from array import array
+import os
+
+EDGE_FILE = "edges.bin"
+EDGE_SIZE = 16  # Two native u64 URL fingerprints: source, target
+
+
+class EdgeLog:
+    """
+    Append-only log of the link graph discovered by the crawler. Every edge
+    is the pair of 64-bit fingerprints of its source and target URLs, so an
+    edge costs 16 bytes no matter how long the URLs are; page ids are
+    joined in later by the PageRank job (services/indexer/pagerank.py).
+    Edges are buffered and appended `buffer_edges` at a time.
+    """
+
+    def __init__(self, path, buffer_edges=65536):
+        self.path = os.path.join(path, EDGE_FILE)
+        self.buffer_edges = buffer_edges
+        os.makedirs(path, exist_ok=True)
+
+        # Drop a torn final edge from a crash, so appends stay aligned
+        if os.path.exists(self.path):
+            size = os.path.getsize(self.path)
+            if size % EDGE_SIZE:
+                os.truncate(self.path, size - size % EDGE_SIZE)
+
+        self.file = open(self.path, "ab")
+        self.buffer = array("Q")
+        self.edges_written = 0
+
+    def add(self, url, links):
+        """Record the outbound links of one fetched page"""
+        source = url_fingerprint(url)
+        for link in links:
+            self.buffer.append(source)
+            self.buffer.append(url_fingerprint(link))
+        if len(self.buffer) >= 2 * self.buffer_edges:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.buffer.tofile(self.file)
+        self.file.flush()
+        self.edges_written += len(self.buffer) // 2
+        self.buffer = array("Q")
+
+    def close(self):
+        self.flush()
+        self.file.close()
@@ -0,0 +1,236 @@
+from services.spider.frontier import shard_of
+import itertools
+import multiprocessing
+import queue
+import time
+
+
+class QueueRouter:
+    """
+    Routes links between the shards of a local crawl. Links for other shards
+    are batched per destination and sent through that shard's
+    multiprocessing queue; sent and received counts live in shared arrays
+    so the coordinator can tell when every shard is idle with nothing in
+    transit.
+
+    A received link is only in the receiving shard's checkpoint log, so a
+    restarted shard re-reads its pending crawler_queue rows, where the
+    sender saved every routed link.
+    """
+
+    # The crawler reads pending rows back itself after a checkpoint restart
+    polls_pending = False
+
+    def __init__(self, index, shards, inboxes, sent, received, idle, crawled, stop, batch_size=100):
+        self.index = index
+        self.shards = shards
+        self.inboxes = inboxes
+        self.sent = sent
+        self.received = received
+        self.idle = idle
+        self.crawled = crawled
+        self.stop = stop
+        self.batch_size = batch_size
+        self.outboxes = {}
+
+    def owns(self, url):
+        return shard_of(url, self.shards) == self.index
+
+    def route(self, url):
+        shard = shard_of(url, self.shards)
+        outbox = self.outboxes.setdefault(shard, [])
+        outbox.append(url)
+        if len(outbox) >= self.batch_size:
+            self._send(shard)
+
+    def _send(self, shard):
+        urls = self.outboxes.pop(shard, None)
+        if not urls:
+            return
+        self.inboxes[shard].put(urls)
+        with self.sent.get_lock():
+            self.sent[self.index] += len(urls)
+
+    def receive(self):
+        """Send partial batches, then return every link routed to this shard so far"""
+        for shard in list(self.outboxes):
+            self._send(shard)
+
+        urls = []
+        inbox = self.inboxes[self.index]
+        while True:
+            try:
+                urls.extend(inbox.get_nowait())
+            except queue.Empty:
+                break
+        if urls:
+            with self.received.get_lock():
+                self.received[self.index] += len(urls)
+        return urls
+
+    def report(self, idle, crawled):
+        self.idle[self.index] = 1 if idle else 0
+        self.crawled[self.index] = crawled
+
+    def stopped(self):
+        return self.stop.is_set()
+
+
+class DatabaseRouter:
+    """
+    Routes links between shards running on different machines against the
+    same database. A discovered link is already written to crawler_queue as
+    pending, so routing is only the owning shard polling for new pending
+    rows of its hosts. A shard stops after `idle_timeout` seconds without
+    work.
+
+    Rows committed out of id order by another node can be missed by the
+    poll; they are still pending and are picked up on the next resume.
+    """
+
+    # Polls already read every pending row of this shard's hosts
+    polls_pending = True
+
+    def __init__(self, db, index, shards, poll_interval=5.0, idle_timeout=300.0, poll_batch=10000):
+        self.db = db
+        self.index = index
+        self.shards = shards
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        # Rows read per poll, so one poll never stalls the crawl loop for long
+        self.poll_batch = poll_batch
+        self.last_poll = 0.0
+        self.idle_since = None
+        # Polls start from the first pending row, so links routed while this
+        # shard was down, which a checkpoint restart would not know about, are read too
+        self.last_id = 0
+
+    def owns(self, url):
+        return shard_of(url, self.shards) == self.index
+
+    def route(self, url):
+        pass  # The discovering shard's pending row is the message
+
+    def receive(self):
+        now = time.monotonic()
+        if now - self.last_poll < self.poll_interval:
+            return []
+        self.last_poll = now
+
+        urls = []
+        rows = self.db.stream_rows("crawler_queue", batch_size=self.poll_batch, where_clause="status = 'pending'",
+                                   columns="id, url", start_after=self.last_id)
+        read = 0
+        try:
+            # At most one batch of rows per poll
+            for row in itertools.islice(rows, self.poll_batch):
+                read += 1
+                self.last_id = row['id']
+                if self.owns(row['url']):
+                    urls.append(row['url'])
+        except Exception as e:
+            # last_id only moved past rows already read, so the next poll picks up from here
+            print(f"[DB Error]: Could not poll crawler_queue: {e}")
+            return urls
+        if read == self.poll_batch:
+            # More rows are waiting; read the next batch on the next call
+            self.last_poll = 0.0
+        return urls
+
+    def report(self, idle, crawled):
+        if not idle:
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = time.monotonic()
+
+    def stopped(self):
+        return self.idle_since is not None and time.monotonic() - self.idle_since >= self.idle_timeout
+
+
+class ShardCoordinator:
+    """
+    Runs a crawl as one process per shard, each crawling the hosts that hash
+    to it. The coordinator restarts shards that crash (they resume from
+    their checkpoint plus their pending rows, or the database), reports
+    overall progress, and stops every shard once all of them are idle and
+    every routed link has been received.
+    """
+
+    def __init__(self, shards, max_restarts=5, report_interval=10.0):
+        self.shards = shards
+        self.max_restarts = max_restarts
+        self.report_interval = report_interval
+
+        # Shards open their own connections; nothing is inherited from this process
+        self.context = multiprocessing.get_context("spawn")
+        self.inboxes = [self.context.Queue() for _ in range(shards)]
+        self.sent = self.context.Array('q', shards)
+        self.received = self.context.Array('q', shards)
+        self.idle = self.context.Array('b', shards)
+        self.crawled = self.context.Array('q', shards)
+        self.stop = self.context.Event()
+
+    def _router(self, index):
+        return QueueRouter(index, self.shards, self.inboxes, self.sent, self.received,
+                           self.idle, self.crawled, self.stop)
+
+    def _start(self, index, target, args, kwargs):
+        process = self.context.Process(
+            target=target,
+            args=args,
+            kwargs={**kwargs, "router": self._router(index)},
+            name=f"crawler-shard-{index}"
+        )
+        process.start()
+        return process
+
+    def _finished(self, previous):
+        """True once every shard is idle and no routed links are in transit, twice in a row"""
+        snapshot = (sum(self.sent), sum(self.received), tuple(self.idle))
+        done = all(self.idle) and snapshot[0] == snapshot[1]
+        return done and snapshot == previous, snapshot
+
+    def run(self, target, *args, **kwargs):
+        """Run target(*args, router=..., **kwargs) in one process per shard"""
+        print(f"[COORDINATOR]: Starting {self.shards} crawler shards")
+        processes = [self._start(i, target, args, kwargs) for i in range(self.shards)]
+        restarts = [0] * self.shards
+        previous = None
+        last_report = time.monotonic()
+
+        try:
+            while any(process.is_alive() for process in processes) or not self.stop.is_set():
+                time.sleep(1.0)
+
+                for i, process in enumerate(processes):
+                    if process.is_alive() or process.exitcode == 0 or self.stop.is_set():
+                        continue
+                    if restarts[i] >= self.max_restarts:
+                        print(f"[COORDINATOR]: Shard {i} failed {restarts[i]} times, stopping the crawl")
+                        self.stop.set()
+                        break
+                    restarts[i] += 1
+                    print(f"[COORDINATOR]: Shard {i} exited with code {process.exitcode}, restarting")
+                    self.idle[i] = 0
+                    processes[i] = self._start(i, target, args, kwargs)
+
+                if not self.stop.is_set():
+                    finished, previous = self._finished(previous)
+                    if finished:
+                        print("[COORDINATOR]: All shards idle, stopping")
+                        self.stop.set()
+
+                now = time.monotonic()
+                if now - last_report >= self.report_interval:
+                    print(f"[COORDINATOR]: {sum(self.crawled)} URLs crawled, "
+                          f"{sum(self.received)}/{sum(self.sent)} routed links received, "
+                          f"{sum(self.idle)}/{self.shards} shards idle")
+                    last_report = now
+
+        except KeyboardInterrupt:
+            print("\n[COORDINATOR]: Interrupted, waiting for shards to save their progress")
+        finally:
+            self.stop.set()
+            for process in processes:
+                process.join()
+            print(f"[COORDINATOR]: Crawl finished: {sum(self.crawled)} URLs crawled by {self.shards} shards")
@@ -0,0 +1,243 @@
+from services.spider.frontier import shard_of
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+SHARD_DIR_RE = re.compile(r"shard-(\d+)-of-(\d+)$")
+
+
+def shard_store_path(path, index, shards):
+    """Store directory of one shard of a sharded crawl; each shard is its own single writer"""
+    return os.path.join(path, f"shard-{index:02d}-of-{shards:02d}")
+
+
+class PageStore:
+    """
+    Content-addressed store for raw page bodies fetched by the crawler.
+
+    Bodies are zlib-compressed and appended to segment files; identical
+    bodies are stored once. Two append-only index files map a body digest to
+    its (segment, offset, length) and a URL to the digest of its latest
+    body; a third maps a URL to the charset of its Content-Type header.
+    Segments are read through mmap. One process (the crawler) writes; any
+    number of readers can call refresh() to see its appends.
+
+    Compression and decompression happen outside the lock, which only
+    guards the indexes, the append handles and the mmaps.
+    """
+
+    BLOB_RECORD = struct.Struct(">20sIQI")   # digest, segment, offset, length
+    URL_RECORD = struct.Struct(">Q20s")      # url fingerprint, digest
+    CHARSET_RECORD = struct.Struct(">Q16s")  # url fingerprint, NUL-padded codec name
+
+    def __init__(self, path, segment_size=256 * 1024 * 1024, compression_level=6):
+        self.path = path
+        self.segment_size = segment_size
+        self.compression_level = compression_level
+        self.lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self.blob_index_path = os.path.join(self.path, "blobs.idx")
+        self.url_index_path = os.path.join(self.path, "urls.idx")
+        self.charset_index_path = os.path.join(self.path, "charsets.idx")
+
+        self.blobs = {}
+        self.urls = {}
+        self.charsets = {}
+        self.index_offsets = {self.blob_index_path: 0, self.url_index_path: 0, self.charset_index_path: 0}
+        self.maps = {}
+        # Append handles, opened on the first put() so readers never create files
+        self.segment_file = None
+        self.blob_index_file = None
+        self.url_index_file = None
+        self.charset_index_file = None
+
+        self.refresh()
+        self.segment_id = self._last_segment_id()
+
+    @staticmethod
+    def url_key(url):
+        return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.path, f"segment-{segment_id:05d}.dat")
+
+    def _last_segment_id(self):
+        ids = [int(name[8:13]) for name in os.listdir(self.path)
+               if name.startswith("segment-") and name.endswith(".dat")]
+        return max(ids, default=0)
+
+    def _read_index(self, index_path, record, apply):
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, "rb") as f:
+            f.seek(self.index_offsets[index_path])
+            data = f.read()
+        # Ignore a partially written trailing record left by a crash
+        usable = len(data) - len(data) % record.size
+        for fields in record.iter_unpack(data[:usable]):
+            apply(fields)
+        self.index_offsets[index_path] += usable
+
+    def refresh(self):
+        """Pick up entries appended by other processes since the last load"""
+        with self.lock:
+            self._read_index(self.blob_index_path, self.BLOB_RECORD,
+                             lambda r: self.blobs.__setitem__(r[0], r[1:]))
+            self._read_index(self.url_index_path, self.URL_RECORD,
+                             lambda r: self.urls.__setitem__(r[0], r[1]))
+            self._read_index(self.charset_index_path, self.CHARSET_RECORD,
+                             lambda r: self.charsets.__setitem__(r[0], r[1].rstrip(b"\0").decode("ascii") or None))
+
+    def _open_for_append(self):
+        if self.segment_file is None:
+            self.segment_file = open(self._segment_path(self.segment_id), "ab")
+            self.blob_index_file = open(self.blob_index_path, "ab")
+            self.url_index_file = open(self.url_index_path, "ab")
+            self.charset_index_file = open(self.charset_index_path, "ab")
+
+    def put(self, url, body, charset=None):
+        """Store a page body (and its header charset, if any) for a URL and return its digest"""
+        digest = hashlib.sha1(body).digest()
+        compressed = None
+        if digest not in self.blobs:
+            compressed = zlib.compress(body, self.compression_level)
+
+        with self.lock:
+            self._open_for_append()
+            # Another thread may have stored the same body meanwhile
+            if digest not in self.blobs and compressed is not None:
+                if self.segment_file.tell() >= self.segment_size:
+                    self.segment_file.close()
+                    self.segment_id += 1
+                    self.segment_file = open(self._segment_path(self.segment_id), "ab")
+
+                # Data first, then the index record that points at it. Flushed
+                # (not fsynced) so readers in other processes see both.
+                offset = self.segment_file.tell()
+                self.segment_file.write(compressed)
+                self.segment_file.flush()
+                self.blob_index_file.write(self.BLOB_RECORD.pack(digest, self.segment_id, offset, len(compressed)))
+                self.blob_index_file.flush()
+                self.index_offsets[self.blob_index_path] = self.blob_index_file.tell()
+                self.blobs[digest] = (self.segment_id, offset, len(compressed))
+
+            key = self.url_key(url)
+            # Codec names that do not fit a record are not kept; decoding then falls back to <meta charset>.
+            # Written before the URL record, so a reader that sees the URL sees its charset too.
+            if charset is not None and len(charset) > self.CHARSET_RECORD.size - 8:
+                charset = None
+            if self.charsets.get(key) != charset:
+                self.charset_index_file.write(self.CHARSET_RECORD.pack(key, (charset or "").encode("ascii")))
+                self.charset_index_file.flush()
+                self.index_offsets[self.charset_index_path] = self.charset_index_file.tell()
+                self.charsets[key] = charset
+            if self.urls.get(key) != digest:
+                self.url_index_file.write(self.URL_RECORD.pack(key, digest))
+                self.url_index_file.flush()
+                self.index_offsets[self.url_index_path] = self.url_index_file.tell()
+                self.urls[key] = digest
+        return digest
+
+    def _map(self, segment_id, end):
+        mapped = self.maps.get(segment_id)
+        if mapped is None or len(mapped) < end:
+            # The segment grew since it was mapped
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(segment_id), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment_id] = mapped
+        return mapped
+
+    def get_blob(self, digest):
+        with self.lock:
+            location = self.blobs.get(digest)
+            if location is None:
+                return None
+            segment_id, offset, length = location
+            mapped = self._map(segment_id, offset + length)
+            # Slicing copies the bytes, so the map may be replaced once the lock is released
+            compressed = mapped[offset:offset + length]
+        return zlib.decompress(compressed)
+
+    def get_page(self, url):
+        """Return (body, header charset or None) for a URL, or (None, None) if it was never stored"""
+        key = self.url_key(url)
+        if key not in self.urls:
+            self.refresh()
+        digest = self.urls.get(key)
+        if digest is None:
+            return None, None
+        return self.get_blob(digest), self.charsets.get(key)
+
+    def get(self, url):
+        """Return the stored body for a URL, or None if it was never stored"""
+        return self.get_page(url)[0]
+
+    def __contains__(self, url):
+        return self.url_key(url) in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+    def close(self):
+        with self.lock:
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps.clear()
+            for f in (self.segment_file, self.blob_index_file, self.url_index_file, self.charset_index_file):
+                if f is not None:
+                    f.close()
+            self.segment_file = self.blob_index_file = self.url_index_file = self.charset_index_file = None
+
+
+class ShardedPageStore:
+    """Read-only view over the page stores written by the shards of a crawl"""
+
+    def __init__(self, groups):
+        # {shard count: {shard index: PageStore}}
+        self.groups = groups
+
+    def get_page(self, url):
+        for shards, stores in self.groups.items():
+            store = stores.get(shard_of(url, shards))
+            if store is not None:
+                body, charset = store.get_page(url)
+                if body is not None:
+                    return body, charset
+        return None, None
+
+    def get(self, url):
+        return self.get_page(url)[0]
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def close(self):
+        for stores in self.groups.values():
+            for store in stores.values():
+                store.close()
+
+
+def open_page_store(path):
+    """Open the page store at `path`, including the per-shard stores of sharded crawls"""
+    groups = {}
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            match = SHARD_DIR_RE.match(name)
+            if match:
+                index, shards = int(match.group(1)), int(match.group(2))
+                groups.setdefault(shards, {})[index] = PageStore(os.path.join(path, name))
+
+    if not groups:
+        return PageStore(path)
+
+    # Pages from unsharded crawls live at the top level
+    if os.path.exists(os.path.join(path, "blobs.idx")):
+        groups[1] = {0: PageStore(path)}
+    return ShardedPageStore(groups)